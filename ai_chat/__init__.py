@@ -1,10 +1,18 @@
+import asyncio
+from typing import List
+
 from nonebot import get_driver
 from nonebot.plugin import PluginMetadata
 
 # 导入配置模块
 from .config import plugin_config, Config
 # 导入数据库模块
-from .data_source import init_db
+from .data_source import init_db, run_cache_sync, run_archive_flush, flush_archive
+from .summary import summary_enabled, run_summary_updates
+from .sender import close_send_pipelines
+from .recorder import get_recorder, run_record_flush
+from .profiling import start_lag_monitor, install_slow_callback_detector, uninstall_slow_callback_detector
+from .usage import load_usage_counters, run_usage_flush, flush_usage
 # 导入事件处理模块 (确保 handlers.py 中有响应器被注册)
 from . import handlers
 
@@ -16,6 +24,8 @@ __plugin_meta__ = PluginMetadata(
     指令:
     /ai_chat group enable/disable - 启用/禁用当前群聊 AI 功能 (管理员)
     /ai_chat blacklist add/remove <QQ号> - 添加/移除 QQ 黑名单 (超级用户)
+    /ai_chat profile [秒数] - 采集一段时间的性能分析数据 (超级用户)
+    /ai_chat usage - 查看当前群聊的 token 用量和配额 (超级用户)
 
     触发方式:
     1. @机器人 + 聊天内容
@@ -29,6 +39,7 @@ __plugin_meta__ = PluginMetadata(
 
 # --- Initialization ---
 driver = get_driver()
+_background_tasks: List[asyncio.Task] = []
 
 @driver.on_startup
 async def _initialize():
@@ -50,4 +61,51 @@ async def _initialize():
         # raise RuntimeError(f"Database initialization failed: {e}") from e
         return # Or just print the error and prevent the plugin from running
 
-    print(f"插件 {__plugin_meta__.name} 初始化完成并加载成功。")
\ No newline at end of file
+    # Token usage ledger and quota counters
+    try:
+        await load_usage_counters()
+    except Exception as e:
+        print(f"插件 {__plugin_meta__.name} 加载 token 用量失败: {e}")
+    _background_tasks.append(asyncio.create_task(run_usage_flush(plugin_config.usage_flush_interval)))
+
+    # Multi-process mode: keep in-memory caches coherent with other workers
+    if plugin_config.worker_count > 1:
+        _background_tasks.append(asyncio.create_task(run_cache_sync(plugin_config.cache_sync_interval)))
+        print(f"插件 {__plugin_meta__.name} 以分片模式运行: worker {plugin_config.worker_index}/{plugin_config.worker_count}")
+
+    # Batched writes of the message archive
+    if plugin_config.archive_enabled:
+        _background_tasks.append(asyncio.create_task(run_archive_flush(plugin_config.archive_flush_interval)))
+
+    # Rolling per-group conversation summaries
+    if summary_enabled():
+        _background_tasks.append(asyncio.create_task(run_summary_updates(plugin_config.summary_check_interval)))
+
+    # Opt-in traffic recording
+    if plugin_config.record_enabled:
+        _background_tasks.append(asyncio.create_task(run_record_flush(plugin_config.record_flush_interval)))
+
+    # Opt-in event loop lag probe and slow callback detection
+    if plugin_config.profiling_enabled:
+        _background_tasks.append(start_lag_monitor(plugin_config.loop_lag_interval, plugin_config.loop_lag_threshold))
+        install_slow_callback_detector(plugin_config.slow_callback_threshold)
+
+    print(f"插件 {__plugin_meta__.name} 初始化完成并加载成功。")
+
+@driver.on_shutdown
+async def _shutdown():
+    """
+    Stop background tasks on bot shutdown.
+    """
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+    await close_send_pipelines()
+    uninstall_slow_callback_detector()
+    # Write out messages still waiting in the archive buffer (waits for an in-flight batch first)
+    await flush_archive()
+    recorder = get_recorder()
+    if recorder:
+        await recorder.flush()
+    await flush_usage()
\ No newline at end of file
@@ -1,7 +1,7 @@
 import yaml
 from pathlib import Path
 from pydantic import BaseModel, Field, validator
-from typing import Optional
+from typing import Dict, List, Literal, Optional
 
 # --- Default Configuration Content ---
 DEFAULT_CONFIG_YAML = """\
@@ -39,9 +39,128 @@ chat_model: "gpt-3.5-turbo"
 
 # Model name to use for impression generation (can be same as chat_model or a different one)
 impression_model: "gpt-3.5-turbo"
+
+# --- Multi-process sharding (optional) ---
+# Number of worker processes sharing data/AI_chat/database.db. Groups are assigned to workers by group_id.
+# Leave at 1 for a single NoneBot process.
+worker_count: 1
+# Index of this worker (0 <= worker_index < worker_count)
+worker_index: 0
+# How often (in seconds) each worker polls the database for changes made by other workers.
+# Admin commands issued on one worker take effect on all others within this delay.
+cache_sync_interval: 2.0
+
+# --- Message archive (long-range context) ---
+# Archive every group message in a full-text indexed table so older relevant messages can be recalled
+# (needs SQLite with FTS5; turned off with a warning at startup otherwise)
+archive_enabled: true
+# Archived messages older than this many days are deleted
+archive_retention_days: 7
+# Maximum number of archived messages kept per group chat
+archive_max_messages_per_group: 20000
+# Messages are written in batches of this size, or every archive_flush_interval seconds
+archive_batch_size: 50
+archive_flush_interval: 5.0
+# Maximum number of older relevant messages added to each prompt
+archive_top_k: 5
+# Token budget for the recalled older messages in each prompt
+archive_token_budget: 300
+
+# --- Rolling group summary (requires archive_enabled) ---
+# Keep a running summary of older conversation per group. Messages not yet covered by the summary are
+# still sent verbatim (at most context_length), so no context is lost between summary updates.
+# Costs extra impression_model calls.
+summary_enabled: false
+# Minimum number of most recent messages sent verbatim when a summary exists
+summary_recent_window: 15
+# The summary is updated once this many new messages have scrolled out of the recent window.
+# Keep summary_recent_window + summary_batch_size <= context_length (30) so every message stays in the prompt or the summary.
+summary_batch_size: 15
+# Seconds between checks for groups whose summary needs updating
+summary_check_interval: 30.0
+# Maximum token count for a generated summary (generated with impression_model)
+summary_max_tokens: 300
+# Prompt template for updating the summary
+# Available variables: {previous_summary}, {messages}
+summary_prompt: |
+  Update the summary of a group chat conversation (max 300 characters) using the previous summary and the new messages below.
+  Keep important topics, decisions and who said what; drop small talk.
+  Previous summary: {previous_summary}
+  New messages:
+  {messages}
+  Updated summary:
+
+# --- Outbound send queue ---
+# Maximum messages per second sent by the bot across all groups, and the allowed burst size
+send_rate: 1.0
+send_burst: 3
+# Replies longer than this many characters are split into several messages on natural boundaries
+send_max_length: 1000
+# Replies longer than this many characters are sent as one merged-forward message instead (0 disables)
+send_forward_threshold: 3000
+# Number of retries for a failed send, with exponential backoff starting at send_retry_delay seconds
+send_max_retries: 2
+send_retry_delay: 1.0
+# Network errors are always retried. Failed actions (muted, message rejected, ...) are only retried
+# for these OneBot retcodes known to be transient for your implementation
+send_retry_retcodes: []
+
+# --- Traffic recording (for replay.py) ---
+# Record anonymized metadata of every handled group message (hashed ids, timestamps, message lengths,
+# @-flags, decisions and stage latencies) to data/AI_chat/recordings/events-w<worker_index>-*.jsonl.gz
+record_enabled: false
+# Start a new recording file after this many records or seconds
+record_rotate_records: 50000
+record_rotate_seconds: 3600
+# Maximum number of recording files kept per worker
+record_max_files: 24
+# Seconds between writes of buffered records
+record_flush_interval: 10.0
+
+# --- Profiling (optional) ---
+# Probe the event loop for lag and log callbacks that block it
+profiling_enabled: false
+# Seconds between event loop lag probes, and the lag (seconds) above which a warning is logged
+loop_lag_interval: 0.5
+loop_lag_threshold: 0.1
+# Callbacks running longer than this many seconds are logged with the offending coroutine
+# (on uvloop and other native loops the loop's debug mode is used and logs through the "asyncio" logger)
+slow_callback_threshold: 0.1
+# Limits for the on-demand "/ai_chat profile [seconds]" capture, written to data/AI_chat/profiles
+profile_max_seconds: 300
+profile_top_n: 30
+
+# --- Token usage and quotas ---
+# Seconds between writes of aggregated token usage to the database
+usage_flush_interval: 60.0
+# Default token quotas per group chat (0 = unlimited). Over-quota groups only answer @-mentions:
+# random replies, impression updates and summary updates are paused until the period ends.
+group_daily_token_quota: 0
+group_hourly_token_quota: 0
+# Per-group overrides, e.g.:
+# group_token_quotas:
+#   "123456789": {daily: 200000, hourly: 20000}
+group_token_quotas: {}
+
+# --- Model routing (optional) ---
+# A faster model for trivial replies; leave empty to send every chat to chat_model
+fast_chat_model: ""
+# @-messages up to this many characters, with an estimated prompt up to this many tokens, use the fast model
+route_fast_max_message_length: 20
+route_fast_max_prompt_tokens: 1500
+# Model tier for random replies: "fast" or "strong" (chat_model)
+route_random_tier: "fast"
+# Per-group tier overrides, e.g.:
+# group_model_tiers:
+#   "123456789": "strong"
+group_model_tiers: {}
 """
 
 # --- Configuration Model ---
+class GroupQuota(BaseModel):
+    daily: Optional[int] = Field(default=None, ge=0) # None falls back to group_daily_token_quota
+    hourly: Optional[int] = Field(default=None, ge=0) # None falls back to group_hourly_token_quota
+
 class Config(BaseModel):
     api_url: str = "https://api.openai.com/v1/chat/completions"
     api_key: str = "sk-xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx"
@@ -62,6 +181,58 @@ class Config(BaseModel):
     impression_model: str = "gpt-3.5-turbo" # Add the impression_model field
     context_length: int = Field(default=30, gt=0, le=100) # Fixed at 30, but configurable for future adjustments
     impression_min_messages: int = Field(default=5, gt=0) # Fixed at 5, but configurable
+    worker_count: int = Field(default=1, gt=0) # Number of processes sharing the database
+    worker_index: int = Field(default=0, ge=0) # Shard handled by this process
+    cache_sync_interval: float = Field(default=2.0, gt=0) # Seconds between cross-process cache polls
+    archive_enabled: bool = True
+    archive_retention_days: int = Field(default=7, gt=0)
+    archive_max_messages_per_group: int = Field(default=20000, gt=0)
+    archive_batch_size: int = Field(default=50, gt=0)
+    archive_flush_interval: float = Field(default=5.0, gt=0)
+    archive_top_k: int = Field(default=5, ge=0) # 0 disables recall while still archiving
+    archive_token_budget: int = Field(default=300, ge=0)
+    summary_enabled: bool = False
+    summary_recent_window: int = Field(default=15, gt=0)
+    summary_batch_size: int = Field(default=15, gt=0)
+    summary_check_interval: float = Field(default=30.0, gt=0)
+    summary_max_tokens: int = Field(default=300, gt=0)
+    summary_prompt: str = Field(
+        default=(
+            "Update the summary of a group chat conversation (max 300 characters) using the previous summary and the new messages below.\n"
+            "Keep important topics, decisions and who said what; drop small talk.\n"
+            "Previous summary: {previous_summary}\n"
+            "New messages:\n"
+            "{messages}\n"
+            "Updated summary:"
+        )
+    )
+    send_rate: float = Field(default=1.0, gt=0)
+    send_burst: int = Field(default=3, gt=0)
+    send_max_length: int = Field(default=1000, gt=0)
+    send_forward_threshold: int = Field(default=3000, ge=0) # 0 disables merged-forward messages
+    send_max_retries: int = Field(default=2, ge=0)
+    send_retry_delay: float = Field(default=1.0, gt=0)
+    send_retry_retcodes: List[int] = Field(default_factory=list)
+    record_enabled: bool = False
+    record_rotate_records: int = Field(default=50000, gt=0)
+    record_rotate_seconds: int = Field(default=3600, gt=0)
+    record_max_files: int = Field(default=24, gt=0)
+    record_flush_interval: float = Field(default=10.0, gt=0)
+    profiling_enabled: bool = False
+    loop_lag_interval: float = Field(default=0.5, gt=0)
+    loop_lag_threshold: float = Field(default=0.1, gt=0)
+    slow_callback_threshold: float = Field(default=0.1, gt=0)
+    profile_max_seconds: int = Field(default=300, gt=0)
+    profile_top_n: int = Field(default=30, gt=0)
+    usage_flush_interval: float = Field(default=60.0, gt=0)
+    group_daily_token_quota: int = Field(default=0, ge=0)
+    group_hourly_token_quota: int = Field(default=0, ge=0)
+    group_token_quotas: Dict[str, GroupQuota] = Field(default_factory=dict)
+    fast_chat_model: Optional[str] = None # Routing is disabled without a fast model
+    route_fast_max_message_length: int = Field(default=20, ge=0)
+    route_fast_max_prompt_tokens: int = Field(default=1500, ge=0)
+    route_random_tier: Literal["fast", "strong"] = "fast"
+    group_model_tiers: Dict[str, Literal["fast", "strong"]] = Field(default_factory=dict)
 
     @validator('api_key')
     def check_api_key(cls, v):
@@ -69,6 +240,20 @@ class Config(BaseModel):
             raise ValueError("Please configure a valid api_key in config.yaml")
         return v
 
+    @validator('group_token_quotas', 'group_model_tiers', pre=True)
+    def stringify_group_ids(cls, v):
+        # YAML parses unquoted group numbers as integers, and an empty value as None
+        if v is None:
+            return {}
+        return {str(k): q for k, q in v.items()} if isinstance(v, dict) else v
+
+    @validator('worker_index')
+    def check_worker_index(cls, v, values):
+        worker_count = values.get('worker_count', 1)
+        if v >= worker_count:
+            raise ValueError(f"worker_index must be smaller than worker_count ({worker_count})")
+        return v
+
 # --- Configuration File Path ---
 CONFIG_DIR = Path("data/AI_chat")
 CONFIG_PATH = CONFIG_DIR / "config.yaml"
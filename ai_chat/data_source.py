@@ -1,13 +1,92 @@
 import aiosqlite
 from pathlib import Path
 import asyncio
-from typing import Optional, Tuple, List
+from collections import OrderedDict
+from typing import Optional, Tuple, List, Dict, Any
 import time
 
+from .config import plugin_config
+from .utils import tokenize_for_search
+
 # --- 数据库文件路径 ---
 DB_DIR = Path("data/AI_chat")
 DB_PATH = DB_DIR / "database.db"
 
+# --- 进程内缓存 ---
+# 单进程时所有写入都经过本模块，缓存天然一致；
+# 多进程分片 (worker_count > 1) 时，写入会同时记录到 cache_changes 表，
+# 其他进程通过 poll_cache_changes() 定期拉取并丢弃对应的缓存项。
+
+# 每个缓存最多保留的条目数
+CACHE_MAX_ENTRIES = 10000
+
+class _LRUCache(OrderedDict):
+    """按最近使用顺序淘汰的有界字典"""
+
+    def __init__(self, maxsize: int):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
+
+_blacklist_cache: Dict[str, bool] = _LRUCache(CACHE_MAX_ENTRIES)
+_impression_cache: Dict[str, Optional[str]] = _LRUCache(CACHE_MAX_ENTRIES)
+_group_setting_cache: Dict[str, Tuple[bool, int]] = _LRUCache(CACHE_MAX_ENTRIES)
+_summary_cache: Dict[str, Optional[Tuple[str, int, int]]] = _LRUCache(CACHE_MAX_ENTRIES)
+_last_change_id: int = 0
+# 缓存代数：每次失效或本地写入都会加 1。
+# 读取数据库前记下代数，若读取期间代数变化，说明读到的值可能已过期，不再写入缓存。
+_cache_generation: int = 0
+
+def _cache_fill(cache: Dict, key: str, value: Any, generation: int):
+    """读取数据库后填充缓存，读取期间缓存发生过变更时放弃填充"""
+    if generation == _cache_generation:
+        cache[key] = value
+
+def _cache_set(cache: Dict, key: str, value: Any):
+    """本地写入后更新缓存，同时使进行中的读取放弃填充"""
+    global _cache_generation
+    _cache_generation += 1
+    cache[key] = value
+
+def _cache_invalidate(cache: Dict, key: str):
+    """丢弃缓存项，同时使进行中的读取放弃填充"""
+    global _cache_generation
+    _cache_generation += 1
+    cache.pop(key, None)
+
+# cache_changes 表中记录的保留时间 (秒)
+CHANGE_LOG_RETENTION = 3600
+
+# --- 消息归档写入缓冲 ---
+# (group_id, user_id, nickname, message, tokens, time)
+_archive_buffer: List[Tuple[str, str, str, str, str, int]] = []
+# 写入失败时消息会放回缓冲区，缓冲区超过该条数后丢弃最旧的消息
+ARCHIVE_BUFFER_MAX = 10000
+# 保证同一时间只有一次批量写入，flush_archive() 返回时之前的写入均已完成
+_archive_flush_lock: Optional[asyncio.Lock] = None
+# 缓冲区满时在后台启动的写入任务
+_archive_flush_task: Optional[asyncio.Task] = None
+# 进行中的批量写入；调用方被取消时写入仍会完成，下次 flush_archive() 会先等待它
+_archive_write_task: Optional[asyncio.Task] = None
+# 自上次清理以来有新消息写入的群聊，用于按群限制归档条数
+_archive_touched_groups: set = set()
+# 归档过期清理的间隔 (秒)
+ARCHIVE_PRUNE_INTERVAL = 600
+
+def _sharding_enabled() -> bool:
+    """是否处于多进程分片模式"""
+    return bool(plugin_config and plugin_config.worker_count > 1)
+
 # --- 初始化数据库 ---
 async def init_db():
     """
@@ -38,21 +117,170 @@ async def init_db():
                     last_reply_time INTEGER DEFAULT 0 -- 存储 Unix 时间戳
                 )
             """)
+            # 创建 cache_changes 表 (多进程缓存失效日志)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS cache_changes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    scope TEXT NOT NULL, -- blacklist / impression / group / summary
+                    key TEXT NOT NULL,
+                    created_at INTEGER -- 存储 Unix 时间戳
+                )
+            """)
+            # 创建 archive_messages 表 (群聊消息归档) 及其 FTS5 索引
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS archive_messages (
+                    id INTEGER PRIMARY KEY,
+                    group_id TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    nickname TEXT,
+                    message TEXT NOT NULL,
+                    tokens TEXT NOT NULL, -- 预先分词 (中文按二元组切分) 后以空格连接的文本
+                    time INTEGER -- 存储 Unix 时间戳
+                )
+            """)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_archive_group_time ON archive_messages (group_id, time)")
+            if plugin_config and plugin_config.archive_enabled:
+                await _init_archive_fts(db)
+            # 创建 token_usage 表 (按小时聚合的 token 用量)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS token_usage (
+                    hour INTEGER NOT NULL, -- 小时起始的 Unix 时间戳
+                    group_id TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    call_type TEXT NOT NULL, -- chat / impression / summary
+                    prompt_tokens INTEGER DEFAULT 0,
+                    completion_tokens INTEGER DEFAULT 0,
+                    total_tokens INTEGER DEFAULT 0,
+                    calls INTEGER DEFAULT 0,
+                    PRIMARY KEY (hour, group_id, user_id, model, call_type)
+                )
+            """)
+            # 创建 group_summaries 表 (群聊滚动摘要)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS group_summaries (
+                    group_id TEXT PRIMARY KEY,
+                    summary_text TEXT,
+                    version INTEGER DEFAULT 0, -- 每次更新加 1，用于检测并发更新
+                    last_message_id INTEGER DEFAULT 0, -- 已纳入摘要的最后一条归档消息 id
+                    last_update INTEGER -- 存储 Unix 时间戳
+                )
+            """)
+            if _sharding_enabled():
+                # WAL 模式允许多个进程同时读写
+                await db.execute("PRAGMA journal_mode=WAL")
             await db.commit()
+            # 只关心启动之后其他进程产生的变更
+            global _last_change_id
+            async with db.execute("SELECT COALESCE(MAX(id), 0) FROM cache_changes") as cursor:
+                row = await cursor.fetchone()
+                _last_change_id = row[0] if row else 0
         print(f"数据库 {DB_PATH} 初始化/连接成功。")
     except Exception as e:
         print(f"数据库 {DB_PATH} 初始化失败: {e}")
         raise # 抛出异常，以便上层处理
 
+async def _init_archive_fts(db: aiosqlite.Connection):
+    """
+    创建归档消息的 FTS5 索引及同步触发器。
+    当前 SQLite 未编译 FTS5 时关闭归档 (及依赖归档的摘要)，不影响插件其他功能。
+    """
+    try:
+        await db.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS archive_fts USING fts5(
+                tokens, content='archive_messages', content_rowid='id'
+            )
+        """)
+    except aiosqlite.OperationalError as e:
+        plugin_config.archive_enabled = False
+        print(f"AI Chat Plugin: 当前 SQLite 不支持 FTS5 ({e})，已关闭消息归档 (archive_enabled) 及群聊摘要。")
+        return
+    # 通过触发器保持 FTS 索引与归档表同步
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS archive_messages_ai AFTER INSERT ON archive_messages BEGIN
+            INSERT INTO archive_fts (rowid, tokens) VALUES (new.id, new.tokens);
+        END
+    """)
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS archive_messages_ad AFTER DELETE ON archive_messages BEGIN
+            INSERT INTO archive_fts (archive_fts, rowid, tokens) VALUES ('delete', old.id, old.tokens);
+        END
+    """)
+
+# --- 跨进程缓存同步 ---
+async def _record_change(db: aiosqlite.Connection, scope: str, key: str):
+    """在同一事务中记录一条缓存失效日志 (仅多进程模式)"""
+    if not _sharding_enabled():
+        return
+    await db.execute(
+        "INSERT INTO cache_changes (scope, key, created_at) VALUES (?, ?, ?)",
+        (scope, key, int(time.time()))
+    )
+
+async def poll_cache_changes() -> int:
+    """
+    拉取其他进程写入的缓存失效日志，并丢弃本进程中对应的缓存项。
+
+    Returns:
+        本次处理的变更条数。
+    """
+    global _last_change_id
+    async with aiosqlite.connect(DB_PATH) as db:
+        async with db.execute(
+            "SELECT id, scope, key FROM cache_changes WHERE id > ? ORDER BY id",
+            (_last_change_id,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+    caches = {
+        "blacklist": _blacklist_cache,
+        "impression": _impression_cache,
+        "group": _group_setting_cache,
+        "summary": _summary_cache,
+    }
+    for change_id, scope, key in rows:
+        cache = caches.get(scope)
+        if cache is not None:
+            _cache_invalidate(cache, key)
+        _last_change_id = change_id
+    return len(rows)
+
+async def prune_cache_changes():
+    """清理过期的缓存失效日志"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(
+            "DELETE FROM cache_changes WHERE created_at < ?",
+            (int(time.time()) - CHANGE_LOG_RETENTION,)
+        )
+        await db.commit()
+
+async def run_cache_sync(interval: float):
+    """后台循环：每隔 interval 秒同步一次缓存，直到任务被取消"""
+    polls = 0
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await poll_cache_changes()
+            polls += 1
+            if polls * interval >= CHANGE_LOG_RETENTION / 4:
+                await prune_cache_changes()
+                polls = 0
+        except Exception as e:
+            print(f"AI Chat Plugin: 同步跨进程缓存时出现错误: {e}")
+
 # --- 数据库操作函数 (后续将逐步实现具体逻辑) ---
 
 # --- Impression 相关 ---
 async def get_impression(qq_id: str) -> Optional[str]:
     """获取指定 QQ 的印象文本"""
+    if qq_id in _impression_cache:
+        return _impression_cache[qq_id]
+    generation = _cache_generation
     async with aiosqlite.connect(DB_PATH) as db:
         async with db.execute("SELECT impression_text FROM impressions WHERE qq_id = ?", (qq_id,)) as cursor:
             row = await cursor.fetchone()
-            return row[0] if row else None
+            impression = row[0] if row else None
+    _cache_fill(_impression_cache, qq_id, impression, generation)
+    return impression
 
 async def update_impression(qq_id: str, impression_text: str):
     """更新或插入指定 QQ 的印象"""
@@ -63,7 +291,9 @@ async def update_impression(qq_id: str, impression_text: str):
                 "INSERT OR REPLACE INTO impressions (qq_id, impression_text, last_update) VALUES (?, ?, ?)",
                 (qq_id, impression_text, current_time)
             )
+            await _record_change(db, "impression", qq_id)
             await db.commit()
+        _cache_set(_impression_cache, qq_id, impression_text)
     except Exception as e:
         # Log error according to the requested format
         print(f"AI Chat Plugin: 在数据库 impressions 写入 {qq_id} 时出现错误，写入失败: {e}")
@@ -73,25 +303,37 @@ async def update_impression(qq_id: str, impression_text: str):
 # --- Blacklist 相关 ---
 async def is_blacklisted(qq_id: str) -> bool:
     """检查 QQ 是否在黑名单中"""
+    if qq_id in _blacklist_cache:
+        return _blacklist_cache[qq_id]
+    generation = _cache_generation
     async with aiosqlite.connect(DB_PATH) as db:
         async with db.execute("SELECT 1 FROM blacklist WHERE qq_id = ?", (qq_id,)) as cursor:
-            return await cursor.fetchone() is not None
+            blacklisted = await cursor.fetchone() is not None
+    _cache_fill(_blacklist_cache, qq_id, blacklisted, generation)
+    return blacklisted
 
 async def add_to_blacklist(qq_id: str):
     """将 QQ 添加到黑名单"""
     async with aiosqlite.connect(DB_PATH) as db:
         await db.execute("INSERT OR IGNORE INTO blacklist (qq_id) VALUES (?)", (qq_id,))
+        await _record_change(db, "blacklist", qq_id)
         await db.commit()
+    _cache_set(_blacklist_cache, qq_id, True)
 
 async def remove_from_blacklist(qq_id: str):
     """将 QQ 从黑名单移除"""
     async with aiosqlite.connect(DB_PATH) as db:
         await db.execute("DELETE FROM blacklist WHERE qq_id = ?", (qq_id,))
+        await _record_change(db, "blacklist", qq_id)
         await db.commit()
+    _cache_set(_blacklist_cache, qq_id, False)
 
 # --- Group Settings 相关 ---
 async def get_group_setting(group_id: str) -> Tuple[bool, int]:
     """获取群聊设置 (enabled, last_reply_time)"""
+    if group_id in _group_setting_cache:
+        return _group_setting_cache[group_id]
+    generation = _cache_generation
     async with aiosqlite.connect(DB_PATH) as db:
         # 尝试插入默认值，如果群聊不存在的话
         await db.execute(
@@ -103,7 +345,9 @@ async def get_group_setting(group_id: str) -> Tuple[bool, int]:
         async with db.execute("SELECT enabled, last_reply_time FROM group_settings WHERE group_id = ?", (group_id,)) as cursor:
             row = await cursor.fetchone()
             # row 不应该为 None，因为上面保证了插入
-            return (bool(row[0]), row[1]) if row else (True, 0) # 提供默认值以防万一
+            setting = (bool(row[0]), row[1]) if row else (True, 0) # 提供默认值以防万一
+    _cache_fill(_group_setting_cache, group_id, setting, generation)
+    return setting
 
 async def update_group_enabled(group_id: str, enabled: bool):
     """更新群聊启用状态"""
@@ -112,7 +356,20 @@ async def update_group_enabled(group_id: str, enabled: bool):
             "INSERT OR REPLACE INTO group_settings (group_id, enabled, last_reply_time) VALUES (?, ?, COALESCE((SELECT last_reply_time FROM group_settings WHERE group_id = ?), 0))",
             (group_id, enabled, group_id) # 使用 COALESCE 保留旧的 last_reply_time
         )
+        await _record_change(db, "group", group_id)
         await db.commit()
+    # 下次读取时重新加载，以获取最新的 last_reply_time
+    _cache_invalidate(_group_setting_cache, group_id)
+
+def mark_group_replying(group_id: str, reply_time: int):
+    """
+    回复被触发时只在缓存中提前记下 last_reply_time (不写数据库)，
+    使回复在发送队列中等待期间，随机触发同样受 min_reply_interval 限制。
+    发送成功后由 update_group_last_reply_time 写入数据库。
+    """
+    if group_id in _group_setting_cache:
+        enabled, _ = _group_setting_cache[group_id]
+        _cache_set(_group_setting_cache, group_id, (enabled, reply_time))
 
 async def update_group_last_reply_time(group_id: str):
     """更新群聊的最后回复时间"""
@@ -124,4 +381,251 @@ async def update_group_last_reply_time(group_id: str):
         )
         # 如果群聊不存在（理论上不应该，因为 get_group_setting 会创建），此 UPDATE 无效
         # 可以考虑先 INSERT OR IGNORE 再 UPDATE，但 get_group_setting 已处理
-        await db.commit()
\ No newline at end of file
+        await db.commit()
+    # last_reply_time 只由负责该群的进程写入，无需通知其他进程
+    if group_id in _group_setting_cache:
+        enabled, _ = _group_setting_cache[group_id]
+        _cache_set(_group_setting_cache, group_id, (enabled, current_time))
+    else:
+        # 使进行中的读取放弃填充旧的 last_reply_time
+        _cache_invalidate(_group_setting_cache, group_id)
+
+# --- Message Archive 相关 ---
+def queue_archive_message(group_id: str, user_id: str, nickname: str, message: str, timestamp: int):
+    """
+    将一条群聊消息放入归档缓冲区，缓冲区满时在后台批量写入。
+    """
+    if not plugin_config or not plugin_config.archive_enabled or not message:
+        return
+    tokens = " ".join(tokenize_for_search(message))
+    if not tokens:
+        return
+    global _archive_flush_task
+    _archive_buffer.append((group_id, user_id, nickname, message, tokens, timestamp))
+    if len(_archive_buffer) >= plugin_config.archive_batch_size and (_archive_flush_task is None or _archive_flush_task.done()):
+        _archive_flush_task = asyncio.ensure_future(flush_archive())
+
+async def flush_archive() -> int:
+    """
+    将缓冲区中的消息在一个事务内批量写入归档表。
+    会先等待进行中的写入完成，因此返回时此前缓冲的消息均已写入 (或因失败放回缓冲区)。
+
+    Returns:
+        写入的消息条数。
+    """
+    global _archive_buffer, _archive_flush_lock, _archive_write_task
+    if _archive_flush_lock is None:
+        _archive_flush_lock = asyncio.Lock()
+    async with _archive_flush_lock:
+        if _archive_write_task is not None and not _archive_write_task.done():
+            await asyncio.shield(_archive_write_task)
+        if not _archive_buffer:
+            return 0
+        # 先交换缓冲区，避免写入期间新到达的消息丢失或重复写入
+        batch, _archive_buffer = _archive_buffer, []
+        _archive_write_task = asyncio.ensure_future(_write_archive_batch(batch))
+        return await asyncio.shield(_archive_write_task)
+
+async def _write_archive_batch(batch: List[Tuple[str, str, str, str, str, int]]) -> int:
+    """写入一批归档消息，失败时放回缓冲区"""
+    global _archive_buffer
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.executemany(
+                "INSERT INTO archive_messages (group_id, user_id, nickname, message, tokens, time) VALUES (?, ?, ?, ?, ?, ?)",
+                batch
+            )
+            await db.commit()
+    except Exception as e:
+        print(f"AI Chat Plugin: 在数据库 archive_messages 批量写入 {len(batch)} 条消息时出现错误，写入失败: {e}")
+        # 放回缓冲区等待下次写入，保持时间顺序
+        _archive_buffer = (batch + _archive_buffer)[-ARCHIVE_BUFFER_MAX:]
+        return 0
+    _archive_touched_groups.update(record[0] for record in batch)
+    return len(batch)
+
+async def prune_archive():
+    """按保留天数和每群最大条数清理归档消息"""
+    if not plugin_config:
+        return
+    cutoff = int(time.time()) - plugin_config.archive_retention_days * 86400
+    groups = list(_archive_touched_groups)
+    _archive_touched_groups.clear()
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute("DELETE FROM archive_messages WHERE time < ?", (cutoff,))
+        for group_id in groups:
+            await db.execute(
+                """
+                DELETE FROM archive_messages WHERE group_id = ? AND id < COALESCE((
+                    SELECT id FROM archive_messages WHERE group_id = ?
+                    ORDER BY id DESC LIMIT 1 OFFSET ?
+                ), 0)
+                """,
+                (group_id, group_id, plugin_config.archive_max_messages_per_group - 1)
+            )
+        await db.commit()
+
+async def run_archive_flush(interval: float):
+    """后台循环：每隔 interval 秒写入一次归档缓冲区，并定期清理过期归档，直到任务被取消"""
+    elapsed = 0.0
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush_archive()
+            elapsed += interval
+            if elapsed >= ARCHIVE_PRUNE_INTERVAL:
+                await prune_archive()
+                elapsed = 0.0
+        except Exception as e:
+            print(f"AI Chat Plugin: 写入或清理消息归档时出现错误: {e}")
+
+async def search_archive(group_id: str, query: str, before_time: int, limit: int) -> List[Dict[str, Any]]:
+    """
+    使用 FTS5 的 BM25 排序在指定群聊的归档中检索与 query 相关的消息。
+
+    Args:
+        group_id: 目标群聊。
+        query: 检索文本 (通常为当前消息)。
+        before_time: 只返回早于该时间戳的消息，避免与上下文窗口重复。
+        limit: 最多返回的条数。
+
+    Returns:
+        按相关度从高到低排序的消息记录列表，格式与 get_message_history 一致。
+    """
+    # 去重并限制检索词数量，所有检索词以 OR 连接
+    terms = list(dict.fromkeys(tokenize_for_search(query)))[:32]
+    if not terms or limit <= 0:
+        return []
+    match_expr = " OR ".join(f'"{term}"' for term in terms)
+    async with aiosqlite.connect(DB_PATH) as db:
+        async with db.execute(
+            """
+            SELECT m.user_id, m.nickname, m.message, m.time
+            FROM archive_fts JOIN archive_messages m ON m.id = archive_fts.rowid
+            WHERE archive_fts MATCH ? AND m.group_id = ? AND m.time < ?
+            ORDER BY bm25(archive_fts) LIMIT ?
+            """,
+            (match_expr, group_id, before_time, limit)
+        ) as cursor:
+            rows = await cursor.fetchall()
+    return [
+        {"user_id": user_id, "sender": {"nickname": nickname or user_id, "user_id": user_id}, "message": message, "time": timestamp}
+        for user_id, nickname, message, timestamp in rows
+    ]
+
+# --- Group Summary 相关 ---
+async def get_group_summary(group_id: str) -> Optional[Tuple[str, int, int]]:
+    """获取群聊摘要 (summary_text, version, last_message_id)，不存在时返回 None"""
+    if group_id in _summary_cache:
+        return _summary_cache[group_id]
+    generation = _cache_generation
+    async with aiosqlite.connect(DB_PATH) as db:
+        async with db.execute(
+            "SELECT summary_text, version, last_message_id FROM group_summaries WHERE group_id = ?",
+            (group_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+            summary = (row[0], row[1], row[2]) if row else None
+    _cache_fill(_summary_cache, group_id, summary, generation)
+    return summary
+
+async def update_group_summary(group_id: str, summary_text: str, last_message_id: int, expected_version: int) -> Optional[int]:
+    """
+    更新群聊摘要。仅当数据库中的版本号仍为 expected_version 时才写入，避免覆盖并发产生的新摘要。
+
+    Returns:
+        写入后的版本号；版本冲突时返回 None。
+    """
+    current_time = int(time.time())
+    new_version = expected_version + 1
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            if expected_version == 0:
+                cursor = await db.execute(
+                    "INSERT OR IGNORE INTO group_summaries (group_id, summary_text, version, last_message_id, last_update) VALUES (?, ?, ?, ?, ?)",
+                    (group_id, summary_text, new_version, last_message_id, current_time)
+                )
+            else:
+                cursor = await db.execute(
+                    "UPDATE group_summaries SET summary_text = ?, version = ?, last_message_id = ?, last_update = ? WHERE group_id = ? AND version = ?",
+                    (summary_text, new_version, last_message_id, current_time, group_id, expected_version)
+                )
+            if cursor.rowcount == 0:
+                _cache_invalidate(_summary_cache, group_id)
+                return None
+            await _record_change(db, "summary", group_id)
+            await db.commit()
+    except Exception as e:
+        print(f"AI Chat Plugin: 在数据库 group_summaries 写入 {group_id} 时出现错误，写入失败: {e}")
+        raise
+    _cache_set(_summary_cache, group_id, (summary_text, new_version, last_message_id))
+    return new_version
+
+async def get_evicted_messages(group_id: str, after_id: int, keep_recent: int, limit: int) -> List[Dict[str, Any]]:
+    """
+    获取已滚出最近 keep_recent 条窗口、且 id 大于 after_id 的归档消息 (按时间顺序)。
+    积压超过 limit 条时返回其中最早的 limit 条，其余留待下次获取，保证没有消息被跳过。
+
+    Returns:
+        消息记录列表，格式与 get_message_history 一致，并额外包含归档 id。
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        async with db.execute(
+            """
+            SELECT id, user_id, nickname, message, time FROM archive_messages
+            WHERE group_id = ? AND id > ? AND id < COALESCE((
+                SELECT id FROM archive_messages WHERE group_id = ?
+                ORDER BY id DESC LIMIT 1 OFFSET ?
+            ), 0)
+            ORDER BY id ASC LIMIT ?
+            """,
+            (group_id, after_id, group_id, keep_recent - 1, limit)
+        ) as cursor:
+            rows = await cursor.fetchall()
+    return [
+        {"id": message_id, "user_id": user_id, "sender": {"nickname": nickname or user_id, "user_id": user_id}, "message": message, "time": timestamp}
+        for message_id, user_id, nickname, message, timestamp in rows
+    ]
+
+# --- Token Usage 相关 ---
+async def add_token_usage(rows: List[Tuple[int, str, str, str, str, int, int, int, int]]):
+    """
+    在一个事务内批量累加 token 用量。
+
+    Args:
+        rows: (hour, group_id, user_id, model, call_type, prompt_tokens, completion_tokens, total_tokens, calls) 列表。
+    """
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.executemany(
+                """
+                INSERT INTO token_usage (hour, group_id, user_id, model, call_type, prompt_tokens, completion_tokens, total_tokens, calls)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (hour, group_id, user_id, model, call_type) DO UPDATE SET
+                    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                    completion_tokens = completion_tokens + excluded.completion_tokens,
+                    total_tokens = total_tokens + excluded.total_tokens,
+                    calls = calls + excluded.calls
+                """,
+                rows
+            )
+            await db.commit()
+    except Exception as e:
+        print(f"AI Chat Plugin: 在数据库 token_usage 批量写入 {len(rows)} 条记录时出现错误，写入失败: {e}")
+        raise
+
+async def get_group_hourly_usage(since_hour: int) -> List[Tuple[str, int, int]]:
+    """获取 since_hour 之后每个群聊每小时的 token 总用量 (group_id, hour, total_tokens)"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        async with db.execute(
+            "SELECT group_id, hour, SUM(total_tokens) FROM token_usage WHERE hour >= ? GROUP BY group_id, hour",
+            (since_hour,)
+        ) as cursor:
+            return [(row[0], row[1], row[2]) for row in await cursor.fetchall()]
+
+async def get_archive_message_time(message_id: int) -> Optional[int]:
+    """获取指定归档消息的时间戳，消息不存在 (如已被清理) 时返回 None"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        async with db.execute("SELECT time FROM archive_messages WHERE id = ?", (message_id,)) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else None
\ No newline at end of file
@@ -18,16 +18,32 @@ from .data_source import (
     is_blacklisted,
     get_group_setting,
     update_group_last_reply_time,
+    mark_group_replying,
     add_to_blacklist,
     remove_from_blacklist,
     update_group_enabled,
     get_impression,
     update_impression,
+    queue_archive_message,
+    get_group_summary,
+    get_archive_message_time,
 )
 # Import Prompt building functions
 from .prompts import build_prompt, build_impression_prompt
+# Import rolling summary helpers
+from .summary import summary_enabled, mark_group_activity
+# Import the outbound send pipeline
+from .sender import send_group_reply
+# Import the traffic recorder
+from .recorder import EventTrace, get_recorder
+# Import profiling helpers
+from .profiling import capture_profile
+# Import token usage accounting
+from .usage import record_usage, is_over_quota, get_group_usage, get_group_quota
+# Import model routing
+from .routing import choose_model_tier, model_for_tier
 # Import utility functions
-from .utils import get_current_formatted_time, get_message_history # get_message_history is a placeholder
+from .utils import get_current_formatted_time, get_message_history, is_assigned_group, estimate_tokens # get_message_history is a placeholder
 
 # --- Constants (will be read from config later) ---
 CONTEXT_LENGTH = 30
@@ -42,19 +58,46 @@ async def handle_group_message(bot: Bot, event: GroupMessageEvent, matcher: Matc
     if not plugin_config: # Check if config loaded successfully
         return
 
+    message_text = event.get_plaintext().strip()
+    trace = EventTrace(str(event.group_id), str(event.user_id), time.time(), len(message_text), event.is_tome())
+    try:
+        await process_group_message(bot, event, trace)
+    finally:
+        # Messages of groups handled by another worker are recorded there
+        recorder = get_recorder()
+        if recorder and trace.decision != "not_assigned":
+            recorder.record(trace)
+
+async def process_group_message(bot: Bot, event: GroupMessageEvent, trace: EventTrace):
+    """
+    Processes one group message, recording the decision and stage latencies in trace.
+    Replies, including error notices, go through the group's send pipeline.
+    """
     user_id = str(event.user_id)
     group_id = str(event.group_id)
     message_text = event.get_plaintext().strip()
     is_at_me = event.is_tome()
 
+    # 0. Sharding: another worker process handles this group
+    if not is_assigned_group(group_id):
+        trace.decision = "not_assigned"
+        return
+
     # 1. Permission Checks
     if await is_blacklisted(user_id):
+        trace.decision = "blacklisted"
         return
 
     group_enabled, last_reply_time = await get_group_setting(group_id)
     if not group_enabled:
+        trace.decision = "disabled"
         return # If disabled, do not process further
 
+    # Archive every message for long-range recall (written in batches in the background)
+    if message_text:
+        queue_archive_message(group_id, user_id, event.sender.nickname or user_id, message_text, event.time)
+        mark_group_activity(group_id)
+
     # 2. Trigger Conditions
     triggered = False
     current_time = int(time.time())
@@ -62,16 +105,25 @@ async def handle_group_message(bot: Bot, event: GroupMessageEvent, matcher: Matc
     # @ Trigger
     if is_at_me and message_text: # Ensure it's an @ and has actual content
         triggered = True
+        trace.decision = "at"
 
-    # Random Trigger
+    # Random Trigger (disabled while the group is over its token quota)
     elif plugin_config.base_reply_probability > 0:
-        time_since_last_reply = current_time - last_reply_time
-        if time_since_last_reply >= plugin_config.min_reply_interval:
-            if random.random() < plugin_config.base_reply_probability:
-                triggered = True
+        if is_over_quota(group_id):
+            trace.decision = "over_quota"
+        else:
+            time_since_last_reply = current_time - last_reply_time
+            if time_since_last_reply >= plugin_config.min_reply_interval:
+                if random.random() < plugin_config.base_reply_probability:
+                    triggered = True
+                    trace.decision = "random"
 
+    trace.mark("checks")
     if not triggered:
         return
+    trace.outcome = "error" # Replaced once the reply has been sent
+    # Close the reply interval now, so random triggers stay quiet while this reply waits in the send queue
+    mark_group_replying(group_id, current_time)
 
     # --- Subsequent processing logic ---
     message_history: List[Dict[str, Any]] = [] # Initialize empty list
@@ -86,26 +138,46 @@ async def handle_group_message(bot: Bot, event: GroupMessageEvent, matcher: Matc
              message_history.append({"user_id": user_id, "sender": sender_info, "message": message_text, "time": current_time})
     except Exception as e:
         print(f"AI Chat Plugin: Error getting message history for group {group_id}: {e}")
-        await matcher.send("抱歉，获取聊天记录时出错，无法生成回复。")
+        await send_group_reply(bot, group_id, "抱歉，获取聊天记录时出错，无法生成回复。")
         return
+    trace.mark("history")
+
+    # --- Rolling Summary ---
+    # With a summary of older conversation, only messages it does not cover yet are sent verbatim
+    # (at least summary_recent_window of them; message_history is already capped at CONTEXT_LENGTH)
+    summary_text = None
+    if summary_enabled():
+        try:
+            summary = await get_group_summary(group_id)
+            if summary:
+                summary_text = summary[0]
+                covered_time = await get_archive_message_time(summary[2])
+                if covered_time is not None:
+                    # Messages from the same second as the last summarized one are kept, so none is lost
+                    uncovered = [record for record in message_history if record.get("time", 0) >= covered_time]
+                    keep = max(len(uncovered), plugin_config.summary_recent_window)
+                    message_history = message_history[-keep:]
+        except Exception as e:
+            print(f"AI Chat Plugin: Error getting conversation summary for group {group_id}: {e}")
 
     # --- Build Prompt ---
     try:
-        prompt = await build_prompt(message_history)
+        prompt = await build_prompt(message_history, group_id=group_id, query=message_text, summary=summary_text)
         if not prompt:
             if plugin_config: # Only send error if config was loaded
-                 await matcher.send("抱歉，构建请求时出错，无法生成回复。")
+                 await send_group_reply(bot, group_id, "抱歉，构建请求时出错，无法生成回复。")
             return
     except Exception as e:
         print(f"AI Chat Plugin: Error building prompt for group {group_id}: {e}")
-        await matcher.send("抱歉，构建请求时出错，无法生成回复。")
+        await send_group_reply(bot, group_id, "抱歉，构建请求时出错，无法生成回复。")
         return
+    trace.mark("prompt")
 
     # --- Call AI API ---
     ai_response = None # Initialize response variable
     if not plugin_config or not plugin_config.api_url or not plugin_config.api_key:
         print("AI Chat Plugin: Error - API URL or Key not configured.")
-        await matcher.send("抱歉，AI 服务未正确配置，无法生成回复。")
+        await send_group_reply(bot, group_id, "抱歉，AI 服务未正确配置，无法生成回复。")
         return
 
     try:
@@ -113,15 +185,21 @@ async def handle_group_message(bot: Bot, event: GroupMessageEvent, matcher: Matc
         user_content_full = prompt.split("<user:", 1)[1].rsplit(">", 1)[0]
     except IndexError:
          print(f"AI Chat Plugin: Error parsing prompt structure for group {group_id}.")
-         await matcher.send("抱歉，处理请求格式时出错，无法生成回复。")
+         await send_group_reply(bot, group_id, "抱歉，处理请求格式时出错，无法生成回复。")
          return
 
+    # Pick the model tier from cheap local features; random replies default to the fast tier
+    trace.model_tier = choose_model_tier(
+        group_id, message_text, estimate_tokens(system_content) + estimate_tokens(user_content_full), trace.decision == "at"
+    )
+    chat_model = model_for_tier(trace.model_tier)
+
     headers = {
         "Authorization": f"Bearer {plugin_config.api_key}",
         "Content-Type": "application/json",
     }
     payload = {
-        "model": plugin_config.chat_model,
+        "model": chat_model,
         "messages": [
             {"role": "system", "content": system_content},
             {"role": "user", "content": user_content_full}
@@ -140,6 +218,7 @@ async def handle_group_message(bot: Bot, event: GroupMessageEvent, matcher: Matc
             response.raise_for_status()
 
             result = response.json()
+            record_usage(group_id, user_id, chat_model, "chat", result.get("usage"))
             if result.get("choices") and len(result["choices"]) > 0:
                 message = result["choices"][0].get("message", {})
                 ai_response = message.get("content")
@@ -153,32 +232,45 @@ async def handle_group_message(bot: Bot, event: GroupMessageEvent, matcher: Matc
 
     except httpx.TimeoutException:
         print(f"AI Chat Plugin: Error - Request to AI API timed out for group {group_id}.")
-        await matcher.send("抱歉，连接 AI 服务超时，请稍后再试。")
+        await send_group_reply(bot, group_id, "抱歉，连接 AI 服务超时，请稍后再试。")
         return
     except httpx.RequestError as e:
         print(f"AI Chat Plugin: Error - Network error calling AI API for group {group_id}: {e}")
-        await matcher.send("抱歉，连接 AI 服务时发生网络错误。")
+        await send_group_reply(bot, group_id, "抱歉，连接 AI 服务时发生网络错误。")
         return
     except httpx.HTTPStatusError as e:
         print(f"AI Chat Plugin: Error code: {e.response.status_code}")
         error_message = f"抱歉，AI 服务返回错误 ({e.response.status_code})。"
-        await matcher.send(error_message)
+        await send_group_reply(bot, group_id, error_message)
         return
     except Exception as e:
         print(f"AI Chat Plugin: Error - Unexpected error during AI API call for group {group_id}: {e}")
-        await matcher.send("抱歉，与 AI 服务交互时发生未知错误。")
+        await send_group_reply(bot, group_id, "抱歉，与 AI 服务交互时发生未知错误。")
         return
+    trace.mark("model")
 
     # --- Send Reply ---
     try:
         if ai_response:
-            await matcher.send(ai_response)
-            await update_group_last_reply_time(group_id)
+            delivered, complete = await send_group_reply(bot, group_id, ai_response)
+            if delivered:
+                # Users saw at least part of the reply, so it counts for the reply interval and the archive
+                trace.outcome = "replied" if complete else "partial"
+                await update_group_last_reply_time(group_id)
+                queue_archive_message(group_id, str(bot.self_id), "bot", delivered, int(time.time()))
+                if not complete:
+                    print(f"AI Chat Plugin: Error - Reply to group {group_id} was only partially sent.")
+            else:
+                trace.outcome = "send_failed"
+                print(f"AI Chat Plugin: Error - Failed to send message to group {group_id} after retries.")
     except Exception as e:
+        trace.outcome = "send_failed"
         print(f"AI Chat Plugin: Error - Failed to send message to group {group_id}: {e}")
+    trace.mark("send")
 
     # --- Impression Generation Logic ---
-    if ai_response and not ai_response.startswith("抱歉"):
+    # Skipped while the group is over its token quota
+    if ai_response and not ai_response.startswith("抱歉") and not is_over_quota(group_id):
         try:
             bot_self_id = bot.self_id
             users_to_update: Dict[str, List[str]] = {}
@@ -222,6 +314,7 @@ async def handle_group_message(bot: Bot, event: GroupMessageEvent, matcher: Matc
                         )
                         impression_response.raise_for_status()
                         impression_result = impression_response.json()
+                        record_usage(group_id, target_user_id, plugin_config.impression_model, "impression", impression_result.get("usage"))
 
                         if impression_result.get("choices") and len(impression_result["choices"]) > 0:
                             message = impression_result["choices"][0].get("message", {})
@@ -251,6 +344,7 @@ async def handle_group_message(bot: Bot, event: GroupMessageEvent, matcher: Matc
 
         except Exception as e:
             print(f"AI Chat Plugin: Error during overall impression generation process for group {group_id}: {e}")
+        trace.mark("impression")
 
 
 # --- Admin Commands ---
@@ -268,6 +362,9 @@ async def handle_admin_command(bot: Bot, event: GroupMessageEvent, matcher: Matc
          await matcher.send("Admin commands must be used in a group chat.")
          return
     group_id = str(event.group_id)
+    # Only the worker owning this group executes the command; others pick up the change via cache sync
+    if not is_assigned_group(group_id):
+        return
 
     if command == "group":
         if len(params) == 1:
@@ -302,10 +399,40 @@ async def handle_admin_command(bot: Bot, event: GroupMessageEvent, matcher: Matc
         else:
             await matcher.send("Usage: /ai_chat blacklist add|remove <QQ Number>")
 
+    elif command == "profile":
+        seconds = 30
+        if params:
+            if not params[0].isdigit() or not 0 < int(params[0]) <= plugin_config.profile_max_seconds:
+                await matcher.send(f"Usage: /ai_chat profile [seconds] (1-{plugin_config.profile_max_seconds})")
+                return
+            seconds = int(params[0])
+        await matcher.send(f"Profiling this worker for {seconds} seconds...")
+        try:
+            profile_path = await capture_profile(seconds, plugin_config.profile_top_n)
+        except RuntimeError as e:
+            await matcher.send(str(e))
+            return
+        except Exception as e:
+            print(f"AI Chat Plugin: Error capturing profile: {e}")
+            await matcher.send("Failed to capture profile.")
+            return
+        await matcher.send(f"Profile written to {profile_path}")
+
+    elif command == "usage":
+        today_tokens, hour_tokens = get_group_usage(group_id)
+        daily_quota, hourly_quota = get_group_quota(group_id)
+        await matcher.send(
+            f"Token usage for this group:\n"
+            f"Today: {today_tokens} / {daily_quota or 'unlimited'}\n"
+            f"This hour: {hour_tokens} / {hourly_quota or 'unlimited'}"
+        )
+
     else:
         usage_text = (
             "AI Chat Admin Commands:\n"
             "/ai_chat group enable|disable - Toggle AI for the current group\n"
-            "/ai_chat blacklist add|remove <QQ Number> - Manage user blacklist (SUPERUSER only)"
+            "/ai_chat blacklist add|remove <QQ Number> - Manage user blacklist (SUPERUSER only)\n"
+            "/ai_chat profile [seconds] - Capture a cProfile of this worker (SUPERUSER only)\n"
+            "/ai_chat usage - Show token usage and quotas of the current group"
         )
         await matcher.send(usage_text)
\ No newline at end of file
@@ -0,0 +1,173 @@
+# profiling.py
+# Opt-in profiling hooks: event-loop lag probe, slow-callback detection and on-demand cProfile capture
+
+import asyncio
+import cProfile
+import io
+import pstats
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+# --- Profile Output Path ---
+PROFILE_DIR = Path("data/AI_chat/profiles")
+
+# Number of lag samples kept for statistics
+LAG_SAMPLE_COUNT = 3600
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from a fixed sleep, which reveals blocking code."""
+
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+        self.samples: Deque[float] = deque(maxlen=LAG_SAMPLE_COUNT)
+
+    async def run(self):
+        """Background loop: probes the event loop every interval seconds until cancelled."""
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - start - self.interval
+            self.samples.append(lag)
+            if lag >= self.threshold:
+                print(f"AI Chat Plugin: Event loop lag {lag * 1000:.1f} ms (threshold {self.threshold * 1000:.0f} ms)")
+
+    def stats(self) -> Dict[str, float]:
+        """Returns lag percentiles in milliseconds over the recent samples."""
+        if not self.samples:
+            return {}
+        ordered = sorted(self.samples)
+        pick = lambda pct: round(ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)] * 1000, 2)
+        return {"samples": len(ordered), "p50": pick(50), "p99": pick(99), "max": round(ordered[-1] * 1000, 2)}
+
+
+# --- Slow Callback Detection ---
+_original_handle_run: Optional[Callable] = None
+slow_callback_count = 0
+# (loop, previous debug flag, previous slow_callback_duration) when falling back to asyncio debug mode
+_debug_fallback: Optional[Tuple[asyncio.AbstractEventLoop, bool, float]] = None
+
+
+def _describe_handle(handle: asyncio.Handle) -> str:
+    """Names the coroutine behind a task step, or falls back to the handle's repr."""
+    task = getattr(handle._callback, "__self__", None)
+    if isinstance(task, asyncio.Task):
+        coro = task.get_coro()
+        frame = getattr(coro, "cr_frame", None)
+        location = f" at {frame.f_code.co_filename}:{frame.f_lineno}" if frame else ""
+        return f"{getattr(coro, '__qualname__', coro)}{location}"
+    return repr(handle)
+
+
+def install_slow_callback_detector(threshold: float):
+    """
+    Logs every event-loop callback that runs for at least threshold seconds.
+
+    On the pure-Python asyncio loop this wraps asyncio.Handle._run, which avoids the overhead of asyncio
+    debug mode. Loops that run callbacks natively (e.g. uvloop) never call Handle._run, so for those the
+    loop's own debug mode is enabled instead; slow callbacks are then reported by the "asyncio" logger.
+    Must be called from the running event loop.
+    """
+    global _original_handle_run, _debug_fallback
+    if _original_handle_run is not None or _debug_fallback is not None:
+        return
+    loop = asyncio.get_running_loop()
+    if not isinstance(loop, asyncio.BaseEventLoop):
+        _debug_fallback = (loop, loop.get_debug(), loop.slow_callback_duration)
+        loop.set_debug(True)
+        loop.slow_callback_duration = threshold
+        print(
+            f"AI Chat Plugin: Event loop {type(loop).__module__}.{type(loop).__name__} does not use asyncio.Handle._run; "
+            "slow callbacks are reported by the loop's debug mode through the \"asyncio\" logger instead."
+        )
+        return
+    _original_handle_run = original_run = asyncio.events.Handle._run
+
+    def _run(self):
+        global slow_callback_count
+        start = time.perf_counter()
+        original_run(self)
+        duration = time.perf_counter() - start
+        if duration >= threshold:
+            slow_callback_count += 1
+            print(f"AI Chat Plugin: Slow callback blocked the event loop for {duration * 1000:.1f} ms: {_describe_handle(self)}")
+
+    asyncio.events.Handle._run = _run
+
+
+def uninstall_slow_callback_detector():
+    """Restores the original asyncio.Handle._run, or the loop's debug settings if debug mode was used."""
+    global _original_handle_run, _debug_fallback
+    if _original_handle_run is not None:
+        asyncio.events.Handle._run = _original_handle_run
+        _original_handle_run = None
+    if _debug_fallback is not None:
+        loop, debug, slow_callback_duration = _debug_fallback
+        _debug_fallback = None
+        if not loop.is_closed():
+            loop.set_debug(debug)
+            loop.slow_callback_duration = slow_callback_duration
+
+
+# --- Event Loop Lag Probe ---
+# Lag monitor started by the plugin when profiling_enabled is set
+lag_monitor: Optional[LoopLagMonitor] = None
+
+
+def start_lag_monitor(interval: float, threshold: float) -> asyncio.Task:
+    """Creates the plugin's lag monitor and starts probing."""
+    global lag_monitor
+    lag_monitor = LoopLagMonitor(interval, threshold)
+    return asyncio.create_task(lag_monitor.run())
+
+
+# --- On-Demand cProfile Capture ---
+_capture_active = False
+
+
+def _write_profile(profiler: cProfile.Profile, path: Path, seconds: float, top_n: int, header: str):
+    buffer = io.StringIO()
+    buffer.write(header)
+    for sort_key in ("tottime", "cumulative"):
+        buffer.write(f"\n=== Top {top_n} functions by {sort_key} ===\n")
+        pstats.Stats(profiler, stream=buffer).sort_stats(sort_key).print_stats(top_n)
+    path.write_text(buffer.getvalue(), encoding="utf-8")
+
+
+async def capture_profile(seconds: float, top_n: int) -> Path:
+    """
+    Profiles everything running on the event loop for a fixed window and writes the hottest functions to a file.
+
+    Raises:
+        RuntimeError: If another capture is already running.
+    """
+    global _capture_active
+    if _capture_active:
+        raise RuntimeError("A profile capture is already running.")
+    _capture_active = True
+    try:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+    finally:
+        _capture_active = False
+
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    path = PROFILE_DIR / f"profile-{time.strftime('%Y%m%d-%H%M%S', time.localtime())}.txt"
+    header = f"Profile window: {seconds:g} s\n"
+    if lag_monitor:
+        header += f"Event loop lag (ms): {lag_monitor.stats()}\n"
+    if _original_handle_run is not None:
+        header += f"Slow callbacks since start: {slow_callback_count}\n"
+    elif _debug_fallback is not None:
+        header += "Slow callbacks: logged by asyncio debug mode (not counted)\n"
+    # Sorting and formatting the stats can take a while, keep it off the event loop
+    await asyncio.to_thread(_write_profile, profiler, path, seconds, top_n, header)
+    return path
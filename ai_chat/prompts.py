@@ -1,25 +1,65 @@
 # prompts.py
 # Build prompts to send to the AI
 
+import time
 from typing import List, Dict, Optional, Any
 
 # Import configuration
 from .config import plugin_config
 # Import database operations
-from .data_source import get_impression
+from .data_source import get_impression, search_archive
 # Import utility functions
-from .utils import get_current_formatted_time
+from .utils import get_current_formatted_time, estimate_tokens
 
 # Message history is expected as List[Dict[str, Any]] from handlers.py
 # Example dict structure (can be refined):
 # {"user_id": "123", "sender": {"nickname": "Nick"}, "message": "Hello", "time": 1678886400}
 
-async def build_prompt(message_history: List[Dict[str, Any]]) -> Optional[str]:
+async def get_archived_context(group_id: str, query: str, message_history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Retrieve older archived messages relevant to the query, limited by archive_top_k and archive_token_budget.
+
+    Only messages older than the current context window are considered.
+
+    Returns:
+        Message records ordered chronologically (oldest first), or an empty list.
+    """
+    if not plugin_config or not plugin_config.archive_enabled or plugin_config.archive_top_k <= 0:
+        return []
+
+    window_start = min((record.get("time", 0) for record in message_history), default=0)
+    if not window_start:
+        return []
+
+    try:
+        candidates = await search_archive(group_id, query, window_start, plugin_config.archive_top_k)
+    except Exception as e:
+        print(f"AI Chat Plugin: Error searching message archive for group {group_id}: {e}")
+        return []
+
+    # Candidates are ranked by relevance; keep the best ones that fit into the token budget
+    selected = []
+    budget = plugin_config.archive_token_budget
+    for record in candidates:
+        cost = estimate_tokens(record["message"]) + 8 # Rough overhead for the sender tag
+        if cost > budget:
+            continue
+        budget -= cost
+        selected.append(record)
+
+    selected.sort(key=lambda x: x.get("time", 0))
+    return selected
+
+
+async def build_prompt(message_history: List[Dict[str, Any]], group_id: Optional[str] = None, query: Optional[str] = None, summary: Optional[str] = None) -> Optional[str]:
     """
     Build the main prompt to send to the AI based on message history, user impressions, and config.
 
     Args:
         message_history: List of recent message records (dictionaries).
+        group_id: The group chat ID, used to recall relevant older messages from the archive.
+        query: The text to recall older messages for (usually the triggering message).
+        summary: The group's rolling summary of conversation older than message_history, if any.
 
     Returns:
         The constructed prompt string, or None if config is not loaded.
@@ -64,6 +104,20 @@ async def build_prompt(message_history: List[Dict[str, Any]]) -> Optional[str]:
     # Join the parts with a space as specified
     user_content = " ".join(user_content_parts)
 
+    # Prepend relevant older messages recalled from the archive
+    if group_id and query:
+        archived = await get_archived_context(group_id, query, message_history)
+        if archived:
+            archived_parts = [
+                f'[{time.strftime("%y/%m/%d/%H:%M", time.localtime(record["time"]))}] {{"{record["user_id"]}"}} {record["message"]}'
+                for record in archived
+            ]
+            user_content = f'(earlier related messages) {" ".join(archived_parts)} (recent messages) {user_content}'
+
+    # Prepend the rolling summary of older conversation
+    if summary:
+        user_content = f'(conversation summary) {summary} {user_content}'
+
     # Get current formatted time
     try:
         current_time_str = get_current_formatted_time()
@@ -120,6 +174,38 @@ async def build_impression_prompt(user_id: str, user_messages: List[str]) -> Opt
         print(f"AI Chat Plugin: Error building impression prompt: {e}")
         return None
 
+async def build_summary_prompt(previous_summary: Optional[str], messages: List[Dict[str, Any]]) -> Optional[str]:
+    """
+    Build the prompt used to update a group's rolling summary.
+
+    Args:
+        previous_summary: The group's current summary, or None if there is none yet.
+        messages: Message records that have scrolled out of the recent window since the last update.
+
+    Returns:
+        The constructed summary prompt string, or None if config is not loaded or template fails.
+    """
+    if not plugin_config:
+        print("AI Chat Plugin: Error - Configuration not loaded, cannot build summary prompt.")
+        return None
+
+    messages_str = "\n".join(
+        f"- {record.get('sender', {}).get('nickname', record.get('user_id'))}: {record.get('message', '').replace(chr(10), ' ').replace(chr(13), '')}"
+        for record in messages
+    )
+
+    try:
+        return plugin_config.summary_prompt.format(
+            previous_summary=previous_summary or "无",
+            messages=messages_str
+        )
+    except KeyError as e:
+        print(f"AI Chat Plugin: Error - Missing variable in summary_prompt template: {e}. Check config.yaml.")
+        return None
+    except Exception as e:
+        print(f"AI Chat Plugin: Error building summary prompt: {e}")
+        return None
+
 # --- Example Usage (for testing, keep commented out) ---
 # async def main():
 #     # ... (example code remains commented) ...
@@ -0,0 +1,186 @@
+# recorder.py
+# Opt-in recorder of anonymized event traffic, used by replay.py
+
+import asyncio
+import gzip
+import hashlib
+import json
+import secrets
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Import configuration
+from .config import plugin_config
+
+# --- Recording File Paths ---
+RECORD_DIR = Path("data/AI_chat/recordings")
+SALT_PATH = RECORD_DIR / ".salt"
+
+# Buffered records are written once this many have accumulated
+RECORD_FLUSH_SIZE = 100
+
+
+class EventTrace:
+    """Decision and per-stage latencies (in milliseconds) of one handled group message."""
+
+    __slots__ = ("group_id", "user_id", "timestamp", "message_length", "is_at_me", "decision", "outcome", "model_tier", "stages", "_start", "_last")
+
+    def __init__(self, group_id: str, user_id: str, timestamp: float, message_length: int, is_at_me: bool):
+        self.group_id = group_id
+        self.user_id = user_id
+        self.timestamp = timestamp
+        self.message_length = message_length
+        self.is_at_me = is_at_me
+        self.decision = "ignored" # not_assigned / blacklisted / disabled / ignored / at / random / over_quota
+        self.outcome = "none" # none / replied / partial / send_failed / error
+        self.model_tier = None # fast / strong, set once the chat model has been chosen
+        self.stages: Dict[str, float] = {}
+        self._start = self._last = time.perf_counter()
+
+    def mark(self, stage: str):
+        """Records the time spent since the previous mark under the given stage name."""
+        now = time.perf_counter()
+        self.stages[stage] = round((now - self._last) * 1000, 3)
+        self._last = now
+
+    @property
+    def total_ms(self) -> float:
+        return round((self._last - self._start) * 1000, 3)
+
+    def to_record(self, salt: str) -> Dict[str, Any]:
+        """Returns the anonymized JSON record; ids are replaced by salted hashes."""
+        return {
+            "group": _hash_id(salt, self.group_id),
+            "user": _hash_id(salt, self.user_id),
+            "time": self.timestamp,
+            "length": self.message_length,
+            "at": self.is_at_me,
+            "decision": self.decision,
+            "outcome": self.outcome,
+            "tier": self.model_tier,
+            "stages": self.stages,
+            "total": self.total_ms,
+        }
+
+
+def _hash_id(salt: str, value: str) -> str:
+    return hashlib.blake2b(value.encode("utf-8"), key=salt.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _load_salt() -> str:
+    """Loads the per-installation hashing salt, creating it on first use."""
+    if SALT_PATH.is_file():
+        return SALT_PATH.read_text(encoding="utf-8").strip()
+    salt = secrets.token_hex(16)
+    SALT_PATH.write_text(salt, encoding="utf-8")
+    return salt
+
+
+class TrafficRecorder:
+    """
+    Writes EventTrace records to gzip-compressed JSONL files, rotated by record count and age.
+
+    Each worker process writes its own files (events-w<worker_index>-...), and record_max_files
+    applies per worker, so workers sharing the data directory never delete each other's recordings.
+    """
+
+    def __init__(self):
+        RECORD_DIR.mkdir(parents=True, exist_ok=True)
+        self.salt = _load_salt()
+        self._buffer: List[str] = []
+        self._path: Optional[Path] = None
+        self._file_records = 0
+        self._file_opened = 0.0
+        self._file_index = 0
+        self._file_prefix = f"events-w{plugin_config.worker_index}-"
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flush_task: Optional[asyncio.Future] = None
+
+    def record(self, trace: EventTrace):
+        self._buffer.append(json.dumps(trace.to_record(self.salt), separators=(",", ":")))
+        if len(self._buffer) >= RECORD_FLUSH_SIZE and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """
+        Writes buffered records in a worker thread so gzip does not block the event loop.
+        Flushes are serialised, so when this returns every record buffered before the call has been written.
+        """
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            lines, self._buffer = self._buffer, []
+            path = self._current_path(len(lines))
+            try:
+                # Shielded so a cancelled caller does not abandon a half-written batch
+                await asyncio.shield(asyncio.to_thread(self._write, path, lines))
+            except Exception as e:
+                print(f"AI Chat Plugin: Error writing traffic recording {path}: {e}")
+
+    def _current_path(self, incoming: int) -> Path:
+        now = time.time()
+        if (
+            self._path is None
+            or self._file_records + incoming > plugin_config.record_rotate_records
+            or now - self._file_opened >= plugin_config.record_rotate_seconds
+        ):
+            self._file_index += 1
+            self._path = RECORD_DIR / f"{self._file_prefix}{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{self._file_index:04d}.jsonl.gz"
+            self._file_records = 0
+            self._file_opened = now
+            self._remove_old_files()
+        self._file_records += incoming
+        return self._path
+
+    def _remove_old_files(self):
+        files = sorted(RECORD_DIR.glob(f"{self._file_prefix}*.jsonl.gz"))
+        # Keep room for the file about to be created
+        for old_file in files[:max(len(files) - plugin_config.record_max_files + 1, 0)]:
+            try:
+                old_file.unlink()
+            except OSError as e:
+                print(f"AI Chat Plugin: Error removing old traffic recording {old_file}: {e}")
+
+    @staticmethod
+    def _write(path: Path, lines: List[str]):
+        # Appending adds a new gzip member; readers decompress all members transparently
+        with gzip.open(path, "at", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+_recorder: Optional[TrafficRecorder] = None
+
+
+def get_recorder() -> Optional[TrafficRecorder]:
+    """Returns the traffic recorder, or None if recording is disabled."""
+    global _recorder
+    if not plugin_config or not plugin_config.record_enabled:
+        return None
+    if _recorder is None:
+        _recorder = TrafficRecorder()
+    return _recorder
+
+
+async def run_record_flush(interval: float):
+    """Background loop: writes buffered records every interval seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        recorder = get_recorder()
+        if recorder:
+            await recorder.flush()
+
+
+def read_recording(path: Path) -> List[Dict[str, Any]]:
+    """Reads a recording file (gzip-compressed or plain JSONL) in chronological order."""
+    opener = gzip.open if path.suffix == ".gz" else open
+    records = []
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    records.sort(key=lambda x: x.get("time", 0))
+    return records
@@ -0,0 +1,324 @@
+# replay.py
+# Replays a traffic recording through the message handler at N times real speed
+#
+# Usage (from the NoneBot project directory):
+#     python path/to/ai_chat/replay.py data/AI_chat/recordings/events-w0-20260101-120000-0001.jsonl.gz --speed 10
+#
+# The replay runs in a temporary directory with a fresh database, against a stub bot and a local mock
+# model server, so it never talks to the real OneBot implementation or AI API. The directory is removed
+# when the replay finishes.
+#
+# Recorded times are compressed onto the replay clock and min_reply_interval is scaled by the speed.
+# Token quotas still use real hours and days, so over_quota decisions only match the recording at --speed 1.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import yaml
+from collections import Counter, defaultdict, deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional
+
+# Plain CJK filler text, so prompts and the archive index see realistic token counts
+FILLER_CHARS = "的一是不了人我在有他这中大来上个国到说们为子和你地出道也时年得就那要下以生会自着去之过家学对可她里后小么心多天而能好都然没日于起还发成事只作当想看文无开手十用主行方又如前所本见经头面公同三已老从动两长知民样现分将外但身些与高意进把法此实回二理美点月明其种声全工己话儿者向情部正名定女问力机给等几很业最间新什打便位因重被走电四第门相次东政海口使教西再平真听世气信北少关并内加化由却代军产入先山五太水万市眼体别处总才场师书比住员九笑性通目华报立马命张活难神数件安表原车白应路期叫死常提感金何更反合放做系计或司利受光王果亲界及今京务制解各任至清物台象记边共风战干接它许八特觉望直服毛林题建南度统色字请交爱让认算论百吃义科怎元社术结六功指思非流每青管夫连远资队跟带花快条院变联言权往展该领传近留红治决周保达办运武半候七必城父强步完革深区即求品士转量空甚众技轻程告江语英基派满式李息写呢识极令黄德收脸钱党倒未持取设始版双历越史商千片容研像找友孩站广改议形委早房音火际则首单手"
+BOT_SELF_ID = "10000"
+# Config.min_reply_interval default, used when the replayed config does not set it
+DEFAULT_MIN_REPLY_INTERVAL = 300
+
+
+# --- Mock Model Server ---
+class MockModelServer:
+    """Minimal OpenAI-compatible chat completions endpoint with configurable latency."""
+
+    def __init__(self, latency: float, reply_length: int):
+        self.latency = latency
+        self.reply_length = reply_length
+        self.requests = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> str:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        port = self._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/v1/chat/completions"
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            content_length = 0
+            await reader.readline() # Request line
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.strip().lower() == "content-length":
+                    content_length = int(value.strip())
+            request = json.loads(await reader.readexactly(content_length)) if content_length else {}
+            self.requests += 1
+
+            await asyncio.sleep(self.latency * random.uniform(0.8, 1.2))
+            reply_length = min(self.reply_length, request.get("max_tokens", self.reply_length))
+            body = json.dumps({
+                "choices": [{"message": {"role": "assistant", "content": "".join(random.choices(FILLER_CHARS, k=reply_length))}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": reply_length, "total_tokens": reply_length},
+            }).encode("utf-8")
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1")
+                + body
+            )
+            await writer.drain()
+        except Exception as e:
+            print(f"Replay: mock model server error: {e}")
+        finally:
+            writer.close()
+
+
+# --- Stub Bot ---
+class StubBot:
+    """Answers the OneBot APIs used by the plugin from replayed traffic, with simulated send latency."""
+
+    def __init__(self, send_latency: float, history_size: int = 50):
+        self.self_id = BOT_SELF_ID
+        self.send_latency = send_latency
+        self.api_calls: Counter = Counter()
+        self._history: Dict[int, Deque[Dict[str, Any]]] = defaultdict(lambda: deque(maxlen=history_size))
+
+    def remember(self, group_id: int, user_id: int, text: str, timestamp: int):
+        self._history[group_id].append({
+            "sender": {"user_id": user_id, "nickname": f"user{user_id}"},
+            "message": text,
+            "time": timestamp,
+        })
+
+    async def call_api(self, api: str, **data: Any) -> Any:
+        self.api_calls[api] += 1
+        if api == "get_group_msg_history":
+            return {"messages": list(self._history[data["group_id"]])}
+        if api.startswith("send_"):
+            await asyncio.sleep(self.send_latency)
+            return {"message_id": self.api_calls[api]}
+        return {}
+
+
+# --- Report ---
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return round(ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)], 3)
+
+def _latency_stats(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50": _percentile(values, 50),
+        "p95": _percentile(values, 95),
+        "p99": _percentile(values, 99),
+        "max": round(max(values), 3),
+    }
+
+def summarize(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Builds the report section for a list of recorded or replayed event records."""
+    stages: Dict[str, List[float]] = defaultdict(list)
+    model_by_tier: Dict[str, List[float]] = defaultdict(list)
+    for record in records:
+        for stage, value in record.get("stages", {}).items():
+            stages[stage].append(value)
+        if record.get("tier") and "model" in record.get("stages", {}):
+            model_by_tier[record["tier"]].append(record["stages"]["model"])
+    return {
+        "events": len(records),
+        "decisions": dict(Counter(record.get("decision") for record in records)),
+        "outcomes": dict(Counter(record.get("outcome") for record in records)),
+        "tiers": dict(Counter(record["tier"] for record in records if record.get("tier"))),
+        "stages_ms": {stage: _latency_stats(values) for stage, values in stages.items()},
+        "model_ms_by_tier": {tier: _latency_stats(values) for tier, values in model_by_tier.items()},
+        "total_ms": _latency_stats([record.get("total", 0) for record in records]),
+    }
+
+
+# --- Replay ---
+def prepare_workdir(config_path: Path, model_url: str, speed: float) -> Path:
+    """
+    Creates a temporary working directory with a copy of the plugin config pointed at the mock server.
+
+    The handler measures min_reply_interval on the wall clock, so it is divided by the replay speed
+    (rounded, at least 1 s) to cover the same span of recorded traffic.
+    """
+    workdir = Path(tempfile.mkdtemp(prefix="ai_chat_replay_"))
+    config_data: Dict[str, Any] = {}
+    if config_path.is_file():
+        with open(config_path, "r", encoding="utf-8") as f:
+            config_data = yaml.safe_load(f) or {}
+    min_reply_interval = config_data.get("min_reply_interval", DEFAULT_MIN_REPLY_INTERVAL)
+    config_data.update({
+        "min_reply_interval": max(round(min_reply_interval / speed), 1),
+        "api_url": model_url,
+        "api_key": "sk-replay",
+        "record_enabled": False,
+        "worker_count": 1,
+        "worker_index": 0,
+    })
+    config_dir = workdir / "data" / "AI_chat"
+    config_dir.mkdir(parents=True)
+    with open(config_dir / "config.yaml", "w", encoding="utf-8") as f:
+        yaml.safe_dump(config_data, f, allow_unicode=True)
+    return workdir
+
+async def replay(args: argparse.Namespace) -> Dict[str, Any]:
+    model_server = MockModelServer(args.model_latency, args.reply_length)
+    model_url = await model_server.start()
+    original_cwd = os.getcwd()
+    workdir = prepare_workdir(args.config.resolve(), model_url, args.speed)
+    os.chdir(workdir)
+    try:
+        return await _run_replay(args, model_server)
+    finally:
+        await model_server.stop()
+        os.chdir(original_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+async def _run_replay(args: argparse.Namespace, model_server: MockModelServer) -> Dict[str, Any]:
+
+    # The plugin reads its config from the working directory at import time
+    import nonebot
+    nonebot.init(driver="~none")
+    from nonebot.adapters.onebot.v11 import GroupMessageEvent, Message
+    from nonebot.adapters.onebot.v11.event import Sender
+    from ai_chat.config import plugin_config
+    from ai_chat.data_source import init_db, add_to_blacklist, update_group_enabled, flush_archive
+    from ai_chat.handlers import process_group_message
+    from ai_chat.recorder import EventTrace, read_recording
+    from ai_chat.sender import close_send_pipelines
+    from ai_chat.usage import flush_usage
+    if not plugin_config:
+        raise SystemExit("Replay: failed to load the plugin configuration.")
+    await init_db()
+
+    records = read_recording(args.recording)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        raise SystemExit("Replay: the recording contains no events.")
+
+    # Map hashed ids to synthetic numeric ids and restore blacklist / disabled state seen in the recording
+    group_ids: Dict[str, int] = {}
+    user_ids: Dict[str, int] = {}
+    for record in records:
+        group_id = group_ids.setdefault(record["group"], 100000 + len(group_ids))
+        user_id = user_ids.setdefault(record["user"], 200000 + len(user_ids))
+        if record.get("decision") == "blacklisted":
+            await add_to_blacklist(str(user_id))
+        elif record.get("decision") == "disabled":
+            await update_group_enabled(str(group_id), False)
+
+    bot = StubBot(args.send_latency)
+    traces: List[EventTrace] = []
+    dispatch_lag: List[float] = []
+    tasks: List[asyncio.Task] = []
+
+    loop = asyncio.get_running_loop()
+    first_time = records[0]["time"]
+    start = loop.time()
+    # Recorded times are shifted and compressed onto the replay's wall clock, so history, archive and
+    # reply-interval timestamps all use the same clock as the handler's time.time()
+    wall_start = time.time()
+    for index, record in enumerate(records):
+        target = start + (record["time"] - first_time) / args.speed
+        delay = target - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        dispatch_lag.append(max(loop.time() - target, 0) * 1000)
+
+        group_id = group_ids[record["group"]]
+        user_id = user_ids[record["user"]]
+        text = "".join(random.choices(FILLER_CHARS, k=record.get("length", 0)))
+        event_time = int(wall_start + (record["time"] - first_time) / args.speed)
+        bot.remember(group_id, user_id, text, event_time)
+        event = GroupMessageEvent(
+            time=event_time,
+            self_id=int(BOT_SELF_ID),
+            post_type="message",
+            sub_type="normal",
+            user_id=user_id,
+            message_type="group",
+            message_id=index + 1,
+            message=Message(text),
+            original_message=Message(text),
+            raw_message=text,
+            font=0,
+            sender=Sender(user_id=user_id, nickname=f"user{user_id}"),
+            to_me=bool(record.get("at")),
+            group_id=group_id,
+        )
+        trace = EventTrace(str(group_id), str(user_id), time.time(), len(text), event.is_tome())
+        traces.append(trace)
+        tasks.append(asyncio.create_task(process_group_message(bot, event, trace)))
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    wall_time = loop.time() - start
+    # Wait for pending writes so nothing touches the database after the work directory is removed
+    await close_send_pipelines()
+    await flush_archive()
+    await flush_usage()
+
+    replayed = summarize([trace.to_record("replay") for trace in traces])
+    replayed.update({
+        "errors": sum(1 for result in results if isinstance(result, BaseException)),
+        "wall_time_s": round(wall_time, 3),
+        "events_per_s": round(len(records) / wall_time, 3) if wall_time > 0 else None,
+        "dispatch_lag_ms": _latency_stats(dispatch_lag),
+        "model_requests": model_server.requests,
+        "api_calls": dict(bot.api_calls),
+    })
+    return {
+        "recording": str(args.recording),
+        "speed": args.speed,
+        "min_reply_interval_s": plugin_config.min_reply_interval,
+        "recorded": summarize(records),
+        "replayed": replayed,
+    }
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replay an AI chat traffic recording against a stub bot and mock model server.")
+    parser.add_argument("recording", type=Path, help="Recording file (.jsonl.gz or .jsonl)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed multiplier (default: 1.0)")
+    parser.add_argument("--config", type=Path, default=Path("data/AI_chat/config.yaml"), help="Plugin config to replay with")
+    parser.add_argument("--model-latency", type=float, default=1.0, help="Mean mock model response time in seconds")
+    parser.add_argument("--reply-length", type=int, default=100, help="Characters in each mock model reply")
+    parser.add_argument("--send-latency", type=float, default=0.05, help="Simulated send latency in seconds")
+    parser.add_argument("--limit", type=int, default=0, help="Replay only the first N events")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for reply decisions and filler text")
+    parser.add_argument("--output", type=Path, help="Also write the JSON report to this file")
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+    args.recording = args.recording.resolve()
+    if args.output:
+        args.output = args.output.resolve()
+    return args
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    report = asyncio.run(replay(args))
+    report_text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(report_text)
+    if args.output:
+        args.output.write_text(report_text, encoding="utf-8")
+
+
+if __name__ == "__main__":
+    # Make the package importable when run as a script
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    main()
@@ -0,0 +1,42 @@
+# routing.py
+# Latency-aware routing of chat requests between a fast and a strong model
+
+# Import configuration
+from .config import plugin_config
+
+FAST_TIER = "fast"
+STRONG_TIER = "strong"
+
+
+def routing_enabled() -> bool:
+    """Routing needs a fast model; without one every request goes to chat_model."""
+    return bool(plugin_config and plugin_config.fast_chat_model)
+
+
+def choose_model_tier(group_id: str, message_text: str, prompt_tokens: int, is_at_me: bool) -> str:
+    """
+    Picks a model tier from cheap local features of the request.
+
+    Group overrides win; random interjections use route_random_tier; @-mentions go to the fast tier
+    only when both the message and the estimated prompt are short.
+    """
+    if not routing_enabled():
+        return STRONG_TIER
+    override = plugin_config.group_model_tiers.get(group_id)
+    if override:
+        return override
+    if not is_at_me:
+        return plugin_config.route_random_tier
+    if (
+        len(message_text) <= plugin_config.route_fast_max_message_length
+        and prompt_tokens <= plugin_config.route_fast_max_prompt_tokens
+    ):
+        return FAST_TIER
+    return STRONG_TIER
+
+
+def model_for_tier(tier: str) -> str:
+    """Returns the model name configured for the tier."""
+    if tier == FAST_TIER and plugin_config.fast_chat_model:
+        return plugin_config.fast_chat_model
+    return plugin_config.chat_model
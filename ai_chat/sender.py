@@ -0,0 +1,184 @@
+# sender.py
+# Rate-limited outbound send pipeline
+
+import asyncio
+import time
+from typing import Dict, List, Tuple
+
+from nonebot.adapters.onebot.v11 import Bot, Message, MessageSegment
+from nonebot.exception import ActionFailed, NetworkError
+
+# Import configuration
+from .config import plugin_config
+# Import utility functions
+from .utils import split_message
+
+# A per-group worker exits after this many idle seconds
+GROUP_WORKER_IDLE_TIMEOUT = 60.0
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Waits until a token is available and takes it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class SendPipeline:
+    """
+    Sends replies for one bot account.
+
+    Each group has its own FIFO queue drained by a worker task, so chunks of one reply stay in order
+    and a slow group does not delay the others. All groups share one token bucket to stay below the
+    protocol side's send throttling.
+    """
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.bucket = TokenBucket(plugin_config.send_rate, plugin_config.send_burst)
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+
+    async def send(self, group_id: str, text: str) -> Tuple[str, bool]:
+        """
+        Queues a reply for the group and waits until it has been delivered.
+
+        Returns:
+            (delivered, complete): the text that actually reached the group (the chunks sent before a failure,
+            or an empty string if nothing was sent), and whether the whole reply was sent.
+        """
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.setdefault(group_id, asyncio.Queue())
+        queue.put_nowait((text, future))
+        if group_id not in self._workers:
+            self._workers[group_id] = asyncio.create_task(self._group_worker(group_id, queue))
+        return await future
+
+    async def _group_worker(self, group_id: str, queue: asyncio.Queue):
+        while True:
+            try:
+                text, future = await asyncio.wait_for(queue.get(), timeout=GROUP_WORKER_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    self._queues.pop(group_id, None)
+                    self._workers.pop(group_id, None)
+                    return
+                continue
+            try:
+                delivered = await self._deliver(group_id, text)
+            except asyncio.CancelledError:
+                # Pipeline closed mid-delivery; release the waiting handler before stopping
+                if not future.done():
+                    future.set_result(("", False))
+                raise
+            except Exception as e:
+                print(f"AI Chat Plugin: Error - Unexpected error sending message to group {group_id}: {e}")
+                delivered = ("", False)
+            if not future.done():
+                future.set_result(delivered)
+
+    async def _deliver(self, group_id: str, text: str) -> Tuple[str, bool]:
+        threshold = plugin_config.send_forward_threshold
+        if threshold and len(text) > threshold:
+            if await self._call_with_retry("send_group_forward_msg", group_id=int(group_id), messages=self._forward_nodes(text)):
+                return text, True
+            print(f"AI Chat Plugin: Failed to send merged-forward message to group {group_id}, falling back to split messages.")
+
+        sent_chunks = []
+        for chunk in split_message(text, plugin_config.send_max_length):
+            if not await self._call_with_retry("send_group_msg", group_id=int(group_id), message=Message(MessageSegment.text(chunk))):
+                return "\n".join(sent_chunks), False
+            sent_chunks.append(chunk)
+        return text, True
+
+    def _forward_nodes(self, text: str) -> List[Dict]:
+        return [
+            {
+                "type": "node",
+                "data": {"name": "AI", "uin": str(self.bot.self_id), "content": Message(MessageSegment.text(chunk))},
+            }
+            for chunk in split_message(text, plugin_config.send_max_length)
+        ]
+
+    async def _call_with_retry(self, api: str, **data) -> bool:
+        """
+        Calls a send API, retrying transient failures with exponential backoff.
+
+        Network errors are retried; ActionFailed (muted, message rejected, ...) is usually permanent and is
+        only retried for retcodes listed in send_retry_retcodes.
+        """
+        for attempt in range(plugin_config.send_max_retries + 1):
+            await self.bucket.acquire()
+            try:
+                await self.bot.call_api(api, **data)
+                return True
+            except NetworkError as e:
+                print(f"AI Chat Plugin: Error - {api} to group {data.get('group_id')} failed (attempt {attempt + 1}): {e}")
+            except ActionFailed as e:
+                print(f"AI Chat Plugin: Error - {api} to group {data.get('group_id')} failed (attempt {attempt + 1}): {e!r}")
+                if getattr(e, "info", {}).get("retcode") not in plugin_config.send_retry_retcodes:
+                    return False
+            if attempt < plugin_config.send_max_retries:
+                await asyncio.sleep(plugin_config.send_retry_delay * (2 ** attempt))
+        return False
+
+    async def close(self):
+        """
+        Cancels all group workers and waits for them to stop.
+        Replies that were queued or being sent are reported as not delivered, so no caller is left waiting.
+        """
+        workers = list(self._workers.values())
+        queues = list(self._queues.values())
+        for task in workers:
+            task.cancel()
+        self._workers.clear()
+        self._queues.clear()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for queue in queues:
+            while not queue.empty():
+                _, future = queue.get_nowait()
+                if not future.done():
+                    future.set_result(("", False))
+
+
+# One pipeline per bot account
+_pipelines: Dict[str, SendPipeline] = {}
+
+
+async def send_group_reply(bot: Bot, group_id: str, text: str) -> Tuple[str, bool]:
+    """
+    Sends a reply to a group through the bot's send pipeline.
+
+    Returns:
+        (delivered, complete): the text that reached the group, which is only the leading chunks if a later
+        chunk failed (empty if nothing was sent), and whether the whole reply was sent.
+    """
+    pipeline = _pipelines.get(bot.self_id)
+    if pipeline is None:
+        pipeline = _pipelines[bot.self_id] = SendPipeline(bot)
+    pipeline.bot = bot # Use the current connection after a reconnect
+    return await pipeline.send(group_id, text)
+
+
+async def close_send_pipelines():
+    """Stops all send pipelines."""
+    pipelines = list(_pipelines.values())
+    _pipelines.clear()
+    for pipeline in pipelines:
+        await pipeline.close()
@@ -0,0 +1,125 @@
+# summary.py
+# Rolling per-group conversation summary, updated in the background
+
+import asyncio
+import httpx
+from typing import Optional, Set
+
+# Import configuration
+from .config import plugin_config
+# Import database operations
+from .data_source import get_group_summary, update_group_summary, get_evicted_messages
+# Import Prompt building functions
+from .prompts import build_summary_prompt
+# Import token usage accounting
+from .usage import record_usage, is_over_quota
+
+# Upper bound on evicted messages passed to a single summary update
+SUMMARY_MAX_BATCH_FACTOR = 4
+
+# Groups that received messages since the last check
+_pending_groups: Set[str] = set()
+
+
+def summary_enabled() -> bool:
+    """Summaries are built from the message archive, so both features must be enabled."""
+    return bool(plugin_config and plugin_config.summary_enabled and plugin_config.archive_enabled)
+
+
+def mark_group_activity(group_id: str):
+    """Schedules the group for a summary check on the next run of run_summary_updates."""
+    if summary_enabled():
+        _pending_groups.add(group_id)
+
+
+async def request_summary(group_id: str, prompt: str) -> Optional[str]:
+    """
+    Sends a summary prompt to the AI API using impression_model, recording token usage for the group.
+
+    Returns:
+        The generated summary, or None on failure.
+    """
+    headers = {
+        "Authorization": f"Bearer {plugin_config.api_key}",
+        "Content-Type": "application/json",
+    }
+    payload = {
+        "model": plugin_config.impression_model,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": plugin_config.summary_max_tokens,
+        "temperature": 0.3,
+    }
+    try:
+        async with httpx.AsyncClient() as client:
+            response = await client.post(
+                plugin_config.api_url,
+                headers=headers,
+                json=payload,
+                timeout=60.0
+            )
+            response.raise_for_status()
+            result = response.json()
+            record_usage(group_id, "", plugin_config.impression_model, "summary", result.get("usage"))
+            if result.get("choices") and len(result["choices"]) > 0:
+                content = result["choices"][0].get("message", {}).get("content")
+                return content.strip() if content else None
+            print("AI Chat Plugin: Error - Unexpected API response structure for summary generation")
+    except httpx.TimeoutException:
+        print("AI Chat Plugin: Error - Summary generation request timed out.")
+    except httpx.RequestError as e:
+        print(f"AI Chat Plugin: Error - Network error during summary generation: {e}")
+    except httpx.HTTPStatusError as e:
+        print(f"AI Chat Plugin: Summary generation Error code: {e.response.status_code}")
+    except Exception as e:
+        print(f"AI Chat Plugin: Error - Unexpected error during summary generation: {e}")
+    return None
+
+
+async def update_summary_if_needed(group_id: str) -> bool:
+    """
+    Folds messages that scrolled out of the recent window into the group's summary, oldest first,
+    once at least summary_batch_size of them have accumulated. Skipped while the group is over its token quota.
+    A backlog larger than one batch (e.g. after an API outage) is worked off over the following runs.
+
+    Returns:
+        True if the summary was updated.
+    """
+    if is_over_quota(group_id):
+        return False
+
+    current = await get_group_summary(group_id)
+    previous_summary, version, last_message_id = current if current else (None, 0, 0)
+
+    batch_limit = plugin_config.summary_batch_size * SUMMARY_MAX_BATCH_FACTOR
+    evicted = await get_evicted_messages(group_id, last_message_id, plugin_config.summary_recent_window, batch_limit)
+    if len(evicted) < plugin_config.summary_batch_size:
+        return False
+
+    prompt = await build_summary_prompt(previous_summary, evicted)
+    if not prompt:
+        return False
+    new_summary = await request_summary(group_id, prompt)
+    if not new_summary:
+        return False
+
+    new_version = await update_group_summary(group_id, new_summary, evicted[-1]["id"], version)
+    if new_version is None:
+        print(f"AI Chat Plugin: Summary for group {group_id} was updated concurrently, discarding this update.")
+        return False
+    if len(evicted) >= batch_limit:
+        # More evicted messages may be waiting; check again on the next run even if the group stays quiet
+        _pending_groups.add(group_id)
+    return True
+
+
+async def run_summary_updates(interval: float):
+    """Background loop: checks active groups every interval seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        groups = list(_pending_groups)
+        _pending_groups.clear()
+        for group_id in groups:
+            try:
+                await update_summary_if_needed(group_id)
+            except Exception as e:
+                print(f"AI Chat Plugin: Error updating conversation summary for group {group_id}: {e}")
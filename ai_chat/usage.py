@@ -0,0 +1,135 @@
+# usage.py
+# Token usage ledger and per-group quota enforcement
+
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Import configuration
+from .config import plugin_config
+# Import database operations
+from .data_source import add_token_usage, get_group_hourly_usage
+
+# Pending usage since the last flush: (hour, group_id, user_id, model, call_type) -> [prompt, completion, total, calls]
+_pending: Dict[Tuple[int, str, str, str, str], List[int]] = {}
+
+# Quota counters per group: [hour, hour_tokens, day, day_tokens]
+_group_counters: Dict[str, List[int]] = {}
+
+
+def _current_hour(now: float) -> int:
+    return int(now // 3600) * 3600
+
+def _current_day(now: float) -> int:
+    """Start of the local day as a Unix timestamp."""
+    local = time.localtime(now)
+    return int(time.mktime((local.tm_year, local.tm_mon, local.tm_mday, 0, 0, 0, 0, 0, -1)))
+
+def _counter(group_id: str, now: float) -> List[int]:
+    """Returns the group's counters, resetting the hour or day total when a new period has started."""
+    hour, day = _current_hour(now), _current_day(now)
+    counter = _group_counters.get(group_id)
+    if counter is None:
+        counter = _group_counters[group_id] = [hour, 0, day, 0]
+    if counter[0] != hour:
+        counter[0], counter[1] = hour, 0
+    if counter[2] != day:
+        counter[2], counter[3] = day, 0
+    return counter
+
+
+def record_usage(group_id: str, user_id: str, model: str, call_type: str, usage: Optional[Dict[str, Any]]):
+    """
+    Adds the `usage` block of a completion to the ledger and the group's quota counters.
+
+    Args:
+        call_type: chat / impression / summary.
+        usage: The response's usage dictionary; ignored if missing.
+    """
+    if not isinstance(usage, dict):
+        return
+    prompt_tokens = int(usage.get("prompt_tokens") or 0)
+    completion_tokens = int(usage.get("completion_tokens") or 0)
+    total_tokens = int(usage.get("total_tokens") or prompt_tokens + completion_tokens)
+
+    now = time.time()
+    entry = _pending.setdefault((_current_hour(now), group_id, user_id, model, call_type), [0, 0, 0, 0])
+    entry[0] += prompt_tokens
+    entry[1] += completion_tokens
+    entry[2] += total_tokens
+    entry[3] += 1
+
+    counter = _counter(group_id, now)
+    counter[1] += total_tokens
+    counter[3] += total_tokens
+
+
+def get_group_quota(group_id: str) -> Tuple[int, int]:
+    """Returns the group's (daily, hourly) token quota; 0 means unlimited."""
+    daily, hourly = plugin_config.group_daily_token_quota, plugin_config.group_hourly_token_quota
+    override = plugin_config.group_token_quotas.get(group_id)
+    if override:
+        if override.daily is not None:
+            daily = override.daily
+        if override.hourly is not None:
+            hourly = override.hourly
+    return daily, hourly
+
+
+def get_group_usage(group_id: str) -> Tuple[int, int]:
+    """Returns the group's token usage (today, this hour)."""
+    counter = _counter(group_id, time.time())
+    return counter[3], counter[1]
+
+
+def is_over_quota(group_id: str) -> bool:
+    """Checks the group's in-memory counters against its daily and hourly quotas."""
+    if not plugin_config:
+        return False
+    daily, hourly = get_group_quota(group_id)
+    if not daily and not hourly:
+        return False
+    counter = _counter(group_id, time.time())
+    return bool((daily and counter[3] >= daily) or (hourly and counter[1] >= hourly))
+
+
+async def load_usage_counters():
+    """Restores today's quota counters from the database after a restart."""
+    now = time.time()
+    hour, day = _current_hour(now), _current_day(now)
+    for group_id, usage_hour, total_tokens in await get_group_hourly_usage(day):
+        counter = _counter(group_id, now)
+        counter[3] += total_tokens
+        if usage_hour == hour:
+            counter[1] += total_tokens
+
+
+async def flush_usage() -> int:
+    """
+    Writes pending usage to the database in one batch.
+
+    Returns:
+        The number of ledger rows written.
+    """
+    global _pending
+    if not _pending:
+        return 0
+    batch, _pending = _pending, {}
+    rows = [key + tuple(values) for key, values in batch.items()]
+    try:
+        await add_token_usage(rows)
+    except Exception:
+        # Error logged in data_source.py; keep the usage for the next flush
+        for key, values in batch.items():
+            entry = _pending.setdefault(key, [0, 0, 0, 0])
+            for index, value in enumerate(values):
+                entry[index] += value
+        return 0
+    return len(rows)
+
+
+async def run_usage_flush(interval: float):
+    """Background loop: writes pending usage every interval seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        await flush_usage()
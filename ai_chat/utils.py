@@ -1,10 +1,14 @@
 # utils.py
 # 辅助函数
 
+import re
 import time
+import zlib
 from typing import List, Optional, Dict, Any
 from nonebot.adapters.onebot.v11 import Bot # Import Bot for API calls
 
+from .config import plugin_config
+
 # --- 时间相关 ---
 def get_current_formatted_time() -> str:
     """
@@ -12,6 +16,86 @@ def get_current_formatted_time() -> str:
     """
     return time.strftime("%y/%m/%d/%H:%M", time.localtime())
 
+# --- Text Helpers ---
+# CJK characters are not separated by spaces, so they are matched separately from latin words
+_CJK_CHARS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af"
+_SEARCH_TOKEN_RE = re.compile(f"[{_CJK_CHARS}]+|[0-9A-Za-z]+")
+_CJK_CHAR_RE = re.compile(f"[{_CJK_CHARS}]")
+
+def tokenize_for_search(text: str) -> List[str]:
+    """
+    Splits text into full-text search tokens.
+
+    Latin words and numbers are lowercased; runs of CJK characters are split into overlapping bigrams
+    (a single isolated character is kept as-is), since SQLite's default tokenizer cannot segment them.
+    """
+    tokens = []
+    for match in _SEARCH_TOKEN_RE.finditer(text):
+        run = match.group(0)
+        if _CJK_CHAR_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        elif len(run) > 1:
+            tokens.append(run.lower())
+    return tokens
+
+def estimate_tokens(text: str) -> int:
+    """
+    Roughly estimates the number of model tokens in text without a tokenizer.
+
+    Counts one token per CJK character and one token per four other non-space characters.
+    """
+    cjk_count = len(_CJK_CHAR_RE.findall(text))
+    other_count = len(text) - cjk_count - text.count(" ")
+    return cjk_count + (max(other_count, 0) + 3) // 4
+
+# Natural boundaries for splitting long replies, most preferred first
+_SPLIT_BOUNDARIES = ["\n\n", "\n", "。", "！", "？", ". ", "! ", "? ", "；", "; ", "，", ", ", " "]
+
+def split_message(text: str, max_length: int) -> List[str]:
+    """
+    Splits a long reply into chunks of at most max_length characters.
+
+    Each chunk is cut at the most preferred natural boundary (paragraph, line, sentence, clause, word)
+    found in the second half of the allowed length; text without any boundary is cut hard.
+    """
+    chunks = []
+    text = text.strip()
+    while len(text) > max_length:
+        window = text[:max_length]
+        cut = 0
+        for boundary in _SPLIT_BOUNDARIES:
+            pos = window.rfind(boundary)
+            if pos >= max_length // 2:
+                cut = pos + len(boundary)
+                break
+        if cut <= 0:
+            cut = max_length
+        chunk = text[:cut].strip()
+        if chunk:
+            chunks.append(chunk)
+        text = text[cut:].strip()
+    if text:
+        chunks.append(text)
+    return chunks
+
+# --- Worker Sharding ---
+def is_assigned_group(group_id: str) -> bool:
+    """
+    Checks whether the given group is handled by this worker process.
+
+    Groups are assigned by group_id modulo worker_count. With a single worker every group is assigned.
+    """
+    if not plugin_config or plugin_config.worker_count <= 1:
+        return True
+    try:
+        shard_key = int(group_id)
+    except ValueError:
+        shard_key = zlib.crc32(group_id.encode("utf-8"))
+    return shard_key % plugin_config.worker_count == plugin_config.worker_index
+
 # --- Message History ---
 async def get_message_history(bot: Bot, group_id: str, count: int = 30) -> List[Dict[str, Any]]:
     """